@@ -1,14 +1,25 @@
 import os
+import io
+import sys
+import argparse
+import math
 import hashlib
 import secrets
 import subprocess
 import json
+import mimetypes
+import struct
+import zlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, session, send_file, send_from_directory
+from flask import Flask, Response, request, jsonify, session, send_file
 from flask_session import Session
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
-from PIL import Image
+import numpy as np
+from PIL import Image, ImageOps
 try:
     from pillow_heif import register_heif_opener
     register_heif_opener()
@@ -16,11 +27,19 @@ try:
 except ImportError:
     HEIC_SUPPORT = False
     print("Warning: pillow-heif not available. HEIC/HEIF files will not be supported.")
+try:
+    import brotli
+except ImportError:
+    brotli = None  # Static assets are then precompressed with gzip only
+import gzip
+import re
 import sqlite3
 import json
 import threading
 import time
-from pathlib import Path
+import weakref
+from collections import deque
+from urllib.parse import quote
 
 # Database lock for thread-safe access
 db_lock = threading.Lock()
@@ -28,6 +47,9 @@ db_lock = threading.Lock()
 # Load configuration
 CONFIG_FILE = 'config.json'
 
+# Ways media transfers can be handed off to a reverse proxy
+OFFLOAD_MODES = ('none', 'x-accel-redirect', 'x-sendfile')
+
 def load_config():
     """Load configuration from config.json file"""
     if not os.path.exists(CONFIG_FILE):
@@ -48,6 +70,14 @@ def load_config():
     if 'media_path' not in config['storage'] or 'thumbnail_path' not in config['storage']:
         raise ValueError("Configuration must contain 'storage.media_path' and 'storage.thumbnail_path' fields")
     
+    offload = config['server'].get('offload', {})
+    if offload.get('mode', 'none') not in OFFLOAD_MODES:
+        raise ValueError(f"'server.offload.mode' must be one of: {', '.join(OFFLOAD_MODES)}")
+    if offload.get('mode', 'none') == 'x-accel-redirect':
+        for location in offload.get('locations', []):
+            if 'path' not in location or 'internal_uri' not in location:
+                raise ValueError("Each 'server.offload.locations' entry must have 'path' and 'internal_uri' fields")
+    
     return config
 
 # Load configuration
@@ -88,10 +118,40 @@ def get_user_storage_paths(username, base_media_path, base_thumbnail_path):
 base_media_path = CONFIG['storage']['media_path']
 base_thumbnail_path = CONFIG['storage']['thumbnail_path']
 
+# Reverse-proxy offload: the app authorizes the request, the proxy streams the file
+offload_config = CONFIG['server'].get('offload', {})
+app.config['OFFLOAD_MODE'] = offload_config.get('mode', 'none')
+app.config['OFFLOAD_HEADER'] = offload_config.get('header', 'X-Sendfile')
+app.config['OFFLOAD_LOCATIONS'] = [
+    (os.path.abspath(os.path.join(os.path.dirname(__file__), location['path'])), location['internal_uri'].rstrip('/'))
+    for location in offload_config.get('locations', [])
+]
+
 app.config['BASE_MEDIA_PATH'] = base_media_path
 app.config['BASE_THUMBNAIL_PATH'] = base_thumbnail_path
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
-app.config['SCAN_INTERVAL'] = 300  # 5 minutes
+app.config['SCAN_INTERVAL'] = 300  # 5 minutes between full passes over each media directory
+app.config['SCAN_POLL_INTERVAL'] = 30  # Seconds between checks for changed directories when caught up
+app.config['SCAN_CYCLE_BUDGET'] = 20  # Seconds of scanning per cycle, shared fairly between users
+app.config['SCAN_BUSY_PAUSE'] = 5  # Pause between cycles while catching up
+app.config['THUMBNAIL_GC_INTERVAL'] = 6 * 3600  # Seconds between orphaned thumbnail sweeps
+app.config['THUMBNAIL_GC_GRACE'] = 3600  # Thumbnails younger than this are never swept
+app.config['RECONCILE_MAX_FRACTION'] = 0.5  # Removing more of a gallery at once waits for an admin to confirm
+app.config['RECONCILE_MIN_ROWS'] = 100  # Removals this small are never held back
+app.config['PROCESSING_MEMORY_BUDGET'] = 512 * 1024 * 1024  # Pixel memory shared by concurrent image decodes
+app.config['MAX_MEDIA_SUBPROCESSES'] = 2  # Concurrent ffmpeg/ffprobe processes
+app.config['PROCESSING_WAIT_TIMEOUT'] = 30  # Seconds to wait for processing capacity before giving up
+app.config['MAX_IMAGE_PIXELS'] = 200_000_000  # Larger images are treated as decompression bombs
+app.config['EXPORT_CHUNK_SIZE'] = 1024 * 1024  # Read size when streaming ZIP exports
+app.config['VIDEO_PREVIEW_FRAMES'] = 20  # Frames in a video scrubbing sprite sheet
+app.config['VIDEO_PREVIEW_COLUMNS'] = 5
+app.config['VIDEO_PREVIEW_TILE_WIDTH'] = 160
+app.config['STATIC_BUILD_DIR'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static_build')  # Fingerprinted, precompressed assets
+app.config['DISPLAY_RENDITION_SIZE'] = 2048  # Longest edge of the images shown in the full-screen viewer
+app.config['DISPLAY_CACHE_MAX_AGE'] = 86400  # Seconds browsers may reuse a display rendition
+app.config['SIMILAR_MAX_DISTANCE'] = 16  # Largest Hamming distance (of 64 bits) accepted by similar-photo search
+app.config['DUPLICATE_DISTANCE'] = 4  # Default Hamming distance for duplicate clusters
+app.config['DUPLICATE_MAX_DISTANCE'] = 5  # Cluster search cost grows quickly with the distance
 
 Session(app)
 
@@ -106,10 +166,37 @@ def ensure_user_directories(username):
 ensure_user_directories(ADMIN_USERNAME)
 
 # Database setup
+def get_media_folder(media_path, filepath):
+    """Folder of a media file relative to its owner's media directory ('' at the top level)"""
+    prefix = os.path.join(media_path, '')
+    if not filepath.startswith(prefix):
+        # Paths recorded through a symlinked media directory
+        prefix = os.path.join(os.path.realpath(media_path), '')
+        filepath = os.path.realpath(filepath)
+        if not filepath.startswith(prefix):
+            return ''
+    return os.path.dirname(filepath)[len(prefix):]
+
+MONTH_NAMES = ['january', 'february', 'march', 'april', 'may', 'june',
+               'july', 'august', 'september', 'october', 'november', 'december']
+
+def search_metadata_sql(row):
+    """SQL expression for the searchable keywords of a media row: type, year and month name"""
+    months = ' '.join(f"WHEN '{i:02d}' THEN '{name}'" for i, name in enumerate(MONTH_NAMES, 1))
+    return (f"{row}.file_type || COALESCE(' ' || strftime('%Y', {row}.created_at), '')"
+            f" || COALESCE(' ' || CASE strftime('%m', {row}.created_at) {months} END, '')")
+
 def init_db():
     conn = sqlite3.connect('gallery.db')
     c = conn.cursor()
     
+    # WAL lets the server keep reading while a bulk import or scan is writing. Set before any
+    # migration writes: the journal mode can't change inside a transaction
+    c.execute('PRAGMA journal_mode=WAL')
+    # One-time data migrations already applied
+    c.execute('PRAGMA user_version')
+    schema_version = c.fetchone()[0]
+    
     # Users table for normal users (admin is in config)
     c.execute('''CREATE TABLE IF NOT EXISTS users
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -136,6 +223,126 @@ def init_db():
     except sqlite3.OperationalError:
         pass  # Column already exists
     
+    # Content hash of the file, filled in by bulk imports (for migration)
+    try:
+        c.execute('ALTER TABLE media ADD COLUMN content_hash TEXT')
+        conn.commit()
+    except sqlite3.OperationalError:
+        pass  # Column already exists
+    
+    # Inode of the file, used to recognise moved and renamed files (for migration)
+    try:
+        c.execute('ALTER TABLE media ADD COLUMN inode INTEGER')
+        conn.commit()
+    except sqlite3.OperationalError:
+        pass  # Column already exists
+    
+    # Perceptual hash of image thumbnails for similar-photo search (for migration)
+    try:
+        c.execute('ALTER TABLE media ADD COLUMN perceptual_hash INTEGER')
+        conn.commit()
+    except sqlite3.OperationalError:
+        pass  # Column already exists
+    
+    # Images the scanner still has to hash; new rows are hashed (or found unhashable) on insert (for migration)
+    try:
+        c.execute('ALTER TABLE media ADD COLUMN phash_pending INTEGER DEFAULT 0')
+        c.execute("UPDATE media SET phash_pending = 1 WHERE perceptual_hash IS NULL AND file_type = 'image'")
+        conn.commit()
+    except sqlite3.OperationalError:
+        pass  # Column already exists
+    
+    # CRC32 of the file for ZIP export, valid while crc32_key (size:mtime_ns) matches (for migration)
+    for column in ('crc32 INTEGER', 'crc32_key TEXT'):
+        try:
+            c.execute(f'ALTER TABLE media ADD COLUMN {column}')
+            conn.commit()
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+    
+    # Folder of the file relative to its owner's media directory, for search (for migration)
+    try:
+        c.execute('ALTER TABLE media ADD COLUMN folder TEXT')
+        conn.commit()
+    except sqlite3.OperationalError:
+        pass  # Column already exists
+    c.execute('SELECT id, filepath, owner_username FROM media WHERE folder IS NULL')
+    rows = c.fetchall()
+    if rows:
+        media_paths = {}
+        for _, _, owner in rows:
+            if owner not in media_paths:
+                media_paths[owner], _ = get_user_storage_paths(owner, base_media_path, base_thumbnail_path)
+        c.executemany('UPDATE media SET folder = ? WHERE id = ?',
+                      [(get_media_folder(media_paths[owner], filepath), media_id) for media_id, filepath, owner in rows])
+        conn.commit()
+    
+    # Full-text index over file names, folders and date/type keywords, kept in sync by triggers
+    # so uploads, scans, bulk imports, moves and deletes all update it
+    c.execute("SELECT name FROM sqlite_master WHERE name = 'media_search'")
+    search_index_exists = c.fetchone() is not None
+    c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS media_search
+                 USING fts5(filename, folder, metadata, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')''')
+    if not search_index_exists:
+        c.execute(f'''INSERT INTO media_search (rowid, filename, folder, metadata)
+                      SELECT id, filename, folder, {search_metadata_sql('media')} FROM media''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS media_search_insert AFTER INSERT ON media
+                  BEGIN
+                      INSERT INTO media_search (rowid, filename, folder, metadata)
+                      VALUES (NEW.id, NEW.filename, NEW.folder, {search_metadata_sql('NEW')});
+                  END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS media_search_delete AFTER DELETE ON media
+                 BEGIN
+                     DELETE FROM media_search WHERE rowid = OLD.id;
+                 END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS media_search_update AFTER UPDATE OF filename, folder, file_type, created_at ON media
+                  BEGIN
+                      DELETE FROM media_search WHERE rowid = OLD.id;
+                      INSERT INTO media_search (rowid, filename, folder, metadata)
+                      VALUES (NEW.id, NEW.filename, NEW.folder, {search_metadata_sql('NEW')});
+                  END''')
+    
+    # Move detection looks up an owner's rows by file size
+    c.execute('CREATE INDEX IF NOT EXISTS idx_media_owner_size ON media (owner_username, size)')
+    # Gallery order; the implicit rowid breaks ties, so neighbors can seek instead of OFFSET
+    c.execute('CREATE INDEX IF NOT EXISTS idx_media_owner_created ON media (owner_username, created_at)')
+    # Covers loading the similarity index of an owner
+    c.execute('CREATE INDEX IF NOT EXISTS idx_media_owner_phash ON media (owner_username, perceptual_hash)')
+    
+    # Bumped by triggers whenever an owner's perceptual hashes change, from any process,
+    # so the in-memory similarity index can check freshness with one primary key lookup
+    c.execute('''CREATE TABLE IF NOT EXISTS phash_generations
+                 (owner_username TEXT PRIMARY KEY,
+                  generation INTEGER NOT NULL)''')
+    for trigger, event, owner in (
+            ('phash_generation_insert', 'INSERT ON media WHEN NEW.perceptual_hash IS NOT NULL', 'NEW'),
+            ('phash_generation_delete', 'DELETE ON media WHEN OLD.perceptual_hash IS NOT NULL', 'OLD'),
+            ('phash_generation_update_old', 'UPDATE OF perceptual_hash, owner_username ON media', 'OLD'),
+            ('phash_generation_update_new', 'UPDATE OF perceptual_hash, owner_username ON media', 'NEW')):
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS {trigger} AFTER {event}
+                      BEGIN
+                          INSERT INTO phash_generations (owner_username, generation) VALUES ({owner}.owner_username, 1)
+                          ON CONFLICT (owner_username) DO UPDATE SET generation = generation + 1;
+                      END''')
+    
+    if schema_version < 1:
+        # Rows that share a stem-named thumbnail were once all given the thumbnail's hash; clear
+        # those once so the scanner rehashes each from its own file
+        c.execute('''UPDATE media SET perceptual_hash = NULL, phash_pending = 1
+                     WHERE perceptual_hash IS NOT NULL AND (thumbnail_path, perceptual_hash) IN
+                           (SELECT thumbnail_path, perceptual_hash FROM media WHERE perceptual_hash IS NOT NULL
+                            GROUP BY thumbnail_path, perceptual_hash HAVING COUNT(*) > 1)''')
+        c.execute('PRAGMA user_version = 1')
+    
+    # Bulk imports in progress; also the checkpoint an interrupted import resumes from
+    c.execute('''CREATE TABLE IF NOT EXISTS bulk_imports
+                 (username TEXT PRIMARY KEY,
+                  directory TEXT NOT NULL,
+                  pid INTEGER NOT NULL,
+                  files_done INTEGER DEFAULT 0,
+                  started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    
     # Shares table to track gallery sharing
     c.execute('''CREATE TABLE IF NOT EXISTS shares
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -170,24 +377,179 @@ def get_media_type(filename):
         return 'video'
     return None
 
+class ProcessingBusy(Exception):
+    """Raised when media processing capacity stays exhausted past the wait timeout"""
+
+class ProcessingGovernor:
+    """Caps concurrent image decodes by estimated pixel memory and bounds ffmpeg/ffprobe processes.
+
+    Upload requests and the scanner thread share one governor, so a burst of large
+    images waits for budget instead of growing the process without limit.
+    """
+    
+    def __init__(self, memory_budget, max_subprocesses, wait_timeout):
+        self.memory_budget = memory_budget
+        self.max_subprocesses = max_subprocesses
+        self.wait_timeout = wait_timeout
+        self._condition = threading.Condition()
+        self._memory_in_use = 0
+        self._active_decodes = 0
+        self._active_subprocesses = 0
+        self._waiting = 0
+        self._rejected = 0
+    
+    def _acquire(self, can_proceed, reserve):
+        with self._condition:
+            self._waiting += 1
+            try:
+                if not self._condition.wait_for(can_proceed, self.wait_timeout):
+                    self._rejected += 1
+                    raise ProcessingBusy('Media processing capacity exhausted')
+            finally:
+                self._waiting -= 1
+            reserve()
+    
+    def _release(self, release):
+        with self._condition:
+            release()
+            self._condition.notify_all()
+    
+    @contextmanager
+    def decode(self, estimated_bytes):
+        """Reserve pixel memory for one decode. Oversized images run once they have the budget to themselves."""
+        amount = min(estimated_bytes, self.memory_budget)
+        
+        def reserve():
+            self._memory_in_use += amount
+            self._active_decodes += 1
+        
+        def release():
+            self._memory_in_use -= amount
+            self._active_decodes -= 1
+        
+        self._acquire(lambda: self._memory_in_use + amount <= self.memory_budget, reserve)
+        try:
+            yield
+        finally:
+            self._release(release)
+    
+    @contextmanager
+    def subprocess_slot(self):
+        """Reserve one of the ffmpeg/ffprobe process slots"""
+        def reserve():
+            self._active_subprocesses += 1
+        
+        def release():
+            self._active_subprocesses -= 1
+        
+        self._acquire(lambda: self._active_subprocesses < self.max_subprocesses, reserve)
+        try:
+            yield
+        finally:
+            self._release(release)
+    
+    def stats(self):
+        with self._condition:
+            return {
+                'memory_budget': self.memory_budget,
+                'memory_in_use': self._memory_in_use,
+                'active_decodes': self._active_decodes,
+                'max_subprocesses': self.max_subprocesses,
+                'active_subprocesses': self._active_subprocesses,
+                'waiting': self._waiting,
+                'rejected': self._rejected
+            }
+
+processing_governor = ProcessingGovernor(
+    app.config['PROCESSING_MEMORY_BUDGET'],
+    app.config['MAX_MEDIA_SUBPROCESSES'],
+    app.config['PROCESSING_WAIT_TIMEOUT']
+)
+
+# Pillow refuses images beyond twice this limit on open; generate_thumbnail enforces the limit itself
+Image.MAX_IMAGE_PIXELS = app.config['MAX_IMAGE_PIXELS']
+
+def run_media_subprocess(cmd, **kwargs):
+    """Run an ffmpeg/ffprobe command within the governor's subprocess limit"""
+    with processing_governor.subprocess_slot():
+        return subprocess.run(cmd, **kwargs)
+
 def generate_video_thumbnail(video_path, output_path):
     try:
+        # -ss before -i seeks on the input instead of decoding up to the timestamp
         cmd = [
             "ffmpeg",
             "-y",
-            "-i", video_path,
             "-ss", "00:00:01",
+            "-i", video_path,
             "-vframes", "1",
             "-vf", "scale=400:-1",
             output_path
         ]
-        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        run_media_subprocess(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
         return True
+    except ProcessingBusy:
+        raise
     except Exception as e:
         print(f"ffmpeg thumbnail failed: {e}")
         return False
 
+def flatten_image(img):
+    """RGB or L copy of an image for JPEG output and hashing, with transparency composited on white"""
+    if img.mode == 'RGBA':
+        rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+        rgb_img.paste(img, mask=img.split()[3])
+        return rgb_img
+    if img.mode not in ('RGB', 'L'):
+        # Convert other modes (like P, CMYK, etc.) to RGB
+        return img.convert('RGB')
+    return img
+
+def compute_perceptual_hash(img):
+    """64-bit difference hash (dHash) of an image, as a signed integer so SQLite can store it.
+
+    Returns None for flat images such as placeholders, which would otherwise all match each other.
+    """
+    small = img.convert('L').resize((9, 8), Image.Resampling.LANCZOS)
+    low, high = small.getextrema()
+    if low == high:
+        return None
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def hash_image_file(filepath):
+    """Perceptual hash of an image file, or None if it can't be decoded.
+
+    Used when the file's thumbnail already exists: thumbnails are named after the file stem,
+    so it may have been made from a same-named file in another folder. The image is reduced
+    the way generate_thumbnail does it, so both give the same hash.
+    """
+    try:
+        with Image.open(filepath) as img:
+            width, height = img.size
+            if width * height > app.config['MAX_IMAGE_PIXELS']:
+                return None
+            img.draft('RGB', (400, 400))
+            width, height = img.size
+            with processing_governor.decode(width * height * 4):
+                img.thumbnail((400, 400), Image.Resampling.LANCZOS)
+                return compute_perceptual_hash(flatten_image(img))
+    except ProcessingBusy:
+        raise
+    except Exception as e:
+        print(f"Error hashing image {filepath}: {e}")
+        return None
+
 def generate_thumbnail(filepath, media_type, output_path):
+    """Write a thumbnail for a media file.
+
+    Returns the perceptual hash of image thumbnails, computed from the already decoded
+    thumbnail, or None for videos and placeholders.
+    """
     try:
         if media_type == 'image':
             # Check if it's a HEIC/HEIF file
@@ -199,42 +561,82 @@ def generate_thumbnail(filepath, media_type, output_path):
                 # Create a placeholder thumbnail for HEIC files when support is not available
                 img = Image.new('RGB', (400, 400), color=(200, 200, 200))
                 img.save(output_path, 'JPEG')
-                return True
+                return None
             
             try:
                 img = Image.open(filepath)
-                img.thumbnail((400, 400), Image.Resampling.LANCZOS)
-                # Convert RGBA to RGB if necessary
-                if img.mode == 'RGBA':
-                    rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                    rgb_img.paste(img, mask=img.split()[3])
-                    img = rgb_img
-                elif img.mode not in ('RGB', 'L'):
-                    # Convert other modes (like P, CMYK, etc.) to RGB
-                    img = img.convert('RGB')
+                # Only the header has been read so far; reject bombs before decoding anything
+                width, height = img.size
+                if width * height > app.config['MAX_IMAGE_PIXELS']:
+                    raise Image.DecompressionBombError(
+                        f"{width}x{height} exceeds the {app.config['MAX_IMAGE_PIXELS']} pixel limit")
+                
+                # Let JPEGs decode at a reduced scale, then budget for the size actually decoded
+                img.draft('RGB', (400, 400))
+                width, height = img.size
+                # Decoded images take roughly 4 bytes per pixel in Pillow
+                with processing_governor.decode(width * height * 4):
+                    img.thumbnail((400, 400), Image.Resampling.LANCZOS)
+                    img = flatten_image(img)
                 img.save(output_path, 'JPEG', quality=85)
-                return True
+                return compute_perceptual_hash(img)
+            except ProcessingBusy:
+                raise
             except Exception as img_error:
                 # If image opening fails (e.g., corrupted file, unsupported format)
                 print(f"Error opening image {filepath}: {img_error}")
                 # Create a placeholder thumbnail
                 img = Image.new('RGB', (400, 400), color=(150, 150, 150))
                 img.save(output_path, 'JPEG')
-                return True
+                return None
         elif media_type == 'video':
             # For videos, we'll create a placeholder or use first frame
             # In production, use ffmpeg for video thumbnails
             generate_video_thumbnail(filepath, output_path)
-            return True
+            return None
+    except ProcessingBusy:
+        raise
     except Exception as e:
         print(f"Error generating thumbnail: {e}")
         # Create a fallback placeholder on any error
         try:
             img = Image.new('RGB', (400, 400), color=(150, 150, 150))
             img.save(output_path, 'JPEG')
-            return True
         except:
+            pass
+        return None
+
+# Formats every browser can show directly, so small originals need no rendition
+BROWSER_IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+def generate_display_rendition(filepath, output_path):
+    """Write a JPEG of an image scaled to fit DISPLAY_RENDITION_SIZE, upright, for the viewer.
+
+    Returns False when the original is better shown as is: already small and browser-viewable,
+    or an animated GIF.
+    """
+    size = app.config['DISPLAY_RENDITION_SIZE']
+    with Image.open(filepath) as img:
+        width, height = img.size
+        if width * height > app.config['MAX_IMAGE_PIXELS']:
+            raise Image.DecompressionBombError(
+                f"{width}x{height} exceeds the {app.config['MAX_IMAGE_PIXELS']} pixel limit")
+        if img.format in BROWSER_IMAGE_FORMATS and (max(width, height) <= size or getattr(img, 'is_animated', False)):
             return False
+        
+        img.draft('RGB', (size, size))
+        width, height = img.size
+        # The orientation fix makes a second copy of the decoded pixels
+        with processing_governor.decode(width * height * 8):
+            rendition = ImageOps.exif_transpose(img)
+            rendition.thumbnail((size, size), Image.Resampling.LANCZOS)
+            rendition = flatten_image(rendition)
+    
+    # Prefetches and views of the same image may race; the rename makes the last one win cleanly
+    temp_path = f"{output_path}.{threading.get_ident()}.tmp"
+    rendition.save(temp_path, 'JPEG', quality=85, progressive=True)
+    os.replace(temp_path, output_path)
+    return True
 
 def get_video_creation_time(path):
     try:
@@ -245,12 +647,14 @@ def get_video_creation_time(path):
             "-show_format",
             path
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_media_subprocess(cmd, capture_output=True, text=True)
         data = json.loads(result.stdout)
         tags = data.get("format", {}).get("tags", {})
         ct = tags.get("creation_time")
         if ct:
             return datetime.fromisoformat(ct.replace("Z", "+00:00"))
+    except ProcessingBusy:
+        raise
     except Exception as e:
         print(f"ffprobe failed: {e}")
 
@@ -258,136 +662,1123 @@ def get_video_creation_time(path):
     stat = os.stat(path)
     return datetime.fromtimestamp(stat.st_mtime)
 
-def scan_media_directory():
-    """Scan all user media directories for files and add them to database"""
-    print("Scanning media directory")
+def get_video_duration(path):
+    """Return the duration of a video in seconds, or None if it cannot be probed"""
+    try:
+        cmd = [
+            "ffprobe",
+            "-v", "quiet",
+            "-print_format", "json",
+            "-show_format",
+            path
+        ]
+        result = run_media_subprocess(cmd, capture_output=True, text=True)
+        data = json.loads(result.stdout)
+        duration = float(data.get("format", {}).get("duration", 0))
+        if duration > 0:
+            return duration
+    except ProcessingBusy:
+        raise
+    except Exception as e:
+        print(f"ffprobe duration failed: {e}")
+    return None
+
+def extract_video_frame(video_path, timestamp, width):
+    """Grab the keyframe nearest to timestamp as a PIL image scaled to width"""
+    cmd = [
+        "ffmpeg",
+        "-v", "error",
+        "-noaccurate_seek",
+        "-ss", f"{timestamp:.3f}",
+        "-i", video_path,
+        "-frames:v", "1",
+        "-vf", f"scale={width}:-2",
+        "-f", "image2pipe",
+        "-vcodec", "mjpeg",
+        "-"
+    ]
+    result = run_media_subprocess(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    if not result.stdout:
+        return None
+    return Image.open(io.BytesIO(result.stdout)).convert('RGB')
+
+def get_video_preview_paths(thumbnail_path, media_id):
+    """Get the sprite sheet and WebVTT index paths of a video, in previews/ beside its thumbnail.
+
+    Keyed by media id: thumbnails are named after the file stem, so same-named videos in
+    different folders share one.
+    """
+    preview_dir = os.path.join(os.path.dirname(thumbnail_path), 'previews')
+    return os.path.join(preview_dir, f"{media_id}.jpg"), os.path.join(preview_dir, f"{media_id}.vtt")
+
+def get_display_rendition_path(thumbnail_path, media_id):
+    """Get the viewer-sized image path of an image, in display/ beside its thumbnail, keyed by media id"""
+    return os.path.join(os.path.dirname(thumbnail_path), 'display', f"{media_id}.jpg")
+
+def get_media_companion_paths(thumbnail_path, media_id):
+    """Files generated for one media row that are deleted with the row"""
+    return list(get_video_preview_paths(thumbnail_path, media_id)) + [get_display_rendition_path(thumbnail_path, media_id)]
+
+def remove_media_thumbnails(c, rows):
+    """Delete the generated files of deleted media rows, given as (id, thumbnail_path).
+
+    Per-row files always go; thumbnails only once no remaining row refers to them, since
+    thumbnail names come from the file stem and rows in different folders can share one.
+    """
+    rows = [(media_id, thumbnail_path) for media_id, thumbnail_path in rows if thumbnail_path]
+    thumbnail_paths = list({thumbnail_path for _, thumbnail_path in rows})
+    c.execute('SELECT DISTINCT thumbnail_path FROM media WHERE thumbnail_path IN (SELECT value FROM json_each(?))',
+              (json.dumps(thumbnail_paths),))
+    still_used = {row[0] for row in c.fetchall()}
+    paths = []
+    for media_id, thumbnail_path in rows:
+        paths.extend(get_media_companion_paths(thumbnail_path, media_id))
+    for thumbnail_path in thumbnail_paths:
+        if thumbnail_path not in still_used:
+            paths.append(thumbnail_path)
+    removed = 0
+    for path in paths:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Could not remove thumbnail {path}: {e}")
+    return removed
+
+# Subdirectories of a thumbnail directory holding per-row generated files
+MEDIA_COMPANION_DIRS = ('previews', 'display')
+
+def collect_orphaned_thumbnails(thumbnail_dir, grace_seconds):
+    """Delete files in a thumbnail directory that no media row refers to.
+
+    Files younger than grace_seconds are kept, since uploads and imports write the
+    thumbnail before inserting its row.
+    """
+    if not os.path.isdir(thumbnail_dir):
+        return 0
+    prefix = os.path.join(thumbnail_dir, '')
+    with db_lock:
+        conn = sqlite3.connect('gallery.db', timeout=10.0)
+        c = conn.cursor()
+        # The thumbnail directory may be shared by several users, so check every owner's rows
+        c.execute('SELECT id, thumbnail_path FROM media WHERE thumbnail_path >= ? AND thumbnail_path < ?',
+                  (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)))
+        referenced = set()
+        for media_id, thumbnail_path in c.fetchall():
+            referenced.add(thumbnail_path)
+            referenced.update(get_media_companion_paths(thumbnail_path, media_id))
+        conn.close()
+    
+    cutoff = time.time() - grace_seconds
+    removed = 0
+    directories = [thumbnail_dir] + [os.path.join(thumbnail_dir, name) for name in MEDIA_COMPANION_DIRS]
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.scandir(directory):
+            try:
+                if entry.is_file() and entry.path not in referenced and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError as e:
+                print(f"Could not remove orphaned thumbnail {entry.path}: {e}")
+    return removed
+
+def format_vtt_timestamp(seconds):
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+def generate_video_preview(video_path, sprite_path, vtt_path):
+    """Build a scrubbing sprite sheet of evenly spaced frames plus its WebVTT index.
+
+    Every frame is grabbed with an input-side keyframe seek, so the cost is a
+    handful of keyframe decodes rather than decoding the whole video.
+    """
+    duration = get_video_duration(video_path)
+    if not duration:
+        return False
+    
+    frame_count = app.config['VIDEO_PREVIEW_FRAMES']
+    columns = app.config['VIDEO_PREVIEW_COLUMNS']
+    tile_width = app.config['VIDEO_PREVIEW_TILE_WIDTH']
+    interval = duration / frame_count
+    
+    frames = []
+    for i in range(frame_count):
+        try:
+            frame = extract_video_frame(video_path, i * interval + interval / 2, tile_width)
+        except ProcessingBusy:
+            raise
+        except Exception as e:
+            print(f"ffmpeg preview frame failed for {video_path}: {e}")
+            frame = None
+        if frame is not None:
+            frames.append((i, frame))
+    if not frames:
+        return False
+    
+    tile_height = frames[0][1].height
+    rows = math.ceil(len(frames) / columns)
+    sprite = Image.new('RGB', (columns * tile_width, rows * tile_height))
+    # Cues reference the sprite relative to the index URL (/api/media/<id>/preview.vtt)
+    sprite_name = 'preview.jpg'
+    cues = ["WEBVTT", ""]
+    for position, (i, frame) in enumerate(frames):
+        if frame.size != (tile_width, tile_height):
+            frame = frame.resize((tile_width, tile_height))
+        x = (position % columns) * tile_width
+        y = (position // columns) * tile_height
+        sprite.paste(frame, (x, y))
+        cues.append(f"{format_vtt_timestamp(i * interval)} --> {format_vtt_timestamp(min((i + 1) * interval, duration))}")
+        cues.append(f"{sprite_name}#xywh={x},{y},{tile_width},{tile_height}")
+        cues.append("")
+    
+    # Write to temporary files first so readers never see a half-written preview
+    sprite.save(sprite_path + '.tmp', 'JPEG', quality=70)
+    with open(vtt_path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write("\n".join(cues))
+    os.replace(sprite_path + '.tmp', sprite_path)
+    os.replace(vtt_path + '.tmp', vtt_path)
+    return True
+
+def get_all_usernames():
+    """Admin plus every user in the database"""
     with db_lock:
-        # Get all usernames (admin + database users)
         conn = sqlite3.connect('gallery.db')
         c = conn.cursor()
-        
         usernames = [ADMIN_USERNAME]
         c.execute('SELECT username FROM users')
         for row in c.fetchall():
             usernames.append(row[0])
         conn.close()
+    return usernames
+
+class UserScanState:
+    """Resumable scan cursor for one user's media directory"""
+    
+    def __init__(self, username):
+        self.username = username
+        self.pending_dirs = deque()  # Directories left in the current full pass
+        self.hot_dirs = deque()  # Recently changed directories, visited before the pass cursor
+        self.dir_mtimes = {}  # Directory -> mtime when it was last listed
+        self.current_dir = None
+        self.current_files = deque()  # Files of current_dir not processed yet
+        self.current_known = {}  # filepath -> (thumbnail_path, inode, perceptual_hash, phash_pending) for current_dir's rows
+        self.current_dir_hot = False
+        self.suspended = None  # Pass directory set aside while changed directories are handled
+        self.pass_started = None
+        self.pass_dirs_seen = 0
+        self.pass_files_seen = 0  # Files listed so far in this pass
+        self.pass_files_done = 0  # Files processed so far in this pass
+        self.last_pass_files = None
+        self.last_pass_completed = None
+        self.vanished = {}  # Media id -> filepath no longer on disk, deleted once moves had a chance to match
+        self.root_device = None  # st_dev of the media directory when first seen, to notice an unmounted disk
+        self.root_available = False  # Whether missing files can currently be trusted to be deleted
+        self.held_removals = 0  # Rows of the last reconcile held back as too large a share of the gallery
+        self.removals_confirmed = False
+        self.last_thumbnail_gc = 0
+        self.added = 0
+        self.regenerated = 0
+        self.moved = 0
+        self.removed = 0
+        self.deferred = 0
+    
+    def has_work(self):
+        return bool(self.current_files or self.suspended or self.hot_dirs or self.pending_dirs)
+    
+    def estimate_remaining_files(self):
+        """Estimated files left in the current pass, from the last pass or the average directory size"""
+        if not self.has_work():
+            return 0
+        listed = self.pass_files_seen - self.pass_files_done
+        if self.pass_started is not None and self.last_pass_files is not None:
+            return max(self.last_pass_files - self.pass_files_done, listed)
+        per_dir = self.pass_files_seen / self.pass_dirs_seen if self.pass_dirs_seen else 0
+        return listed + round(per_dir * (len(self.pending_dirs) + len(self.hot_dirs)))
+
+class ScanScheduler:
+    """Scans every user's media directory in budgeted cycles with a fair share for each user.
+
+    Each user keeps a cursor into their tree that survives between cycles, so large trees
+    make steady progress instead of restarting from the top. Directories whose mtime
+    changed are visited first, so new photos show up quickly even during a long catch-up.
+    """
+    
+    def __init__(self):
+        self.users = {}
+    
+    def _sync_users(self):
+        usernames = [u for u in get_all_usernames() if not is_import_running(u)]
+        for username in usernames:
+            if username not in self.users:
+                self.users[username] = UserScanState(username)
+        for username in list(self.users):
+            if username not in usernames:
+                del self.users[username]
+    
+    def _check_media_root(self, state, media_path):
+        """Whether the media directory exists, isn't empty and is on the device it was first seen on.
+
+        Anything else is more likely an unmounted disk than a deleted gallery.
+        """
+        try:
+            device = os.stat(media_path).st_dev
+            with os.scandir(media_path) as entries:
+                empty = next(entries, None) is None
+        except OSError:
+            return False
+        if empty:
+            return False
+        if state.root_device is None:
+            state.root_device = device
+        return device == state.root_device
+    
+    def _detect_changes(self, state, media_path):
+        """Queue directories modified since they were last listed, and start due full passes"""
+        was_available = state.root_available
+        state.root_available = self._check_media_root(state, media_path)
+        if not state.root_available:
+            if was_available:
+                print(f"Scan for {state.username}: {media_path} is missing, empty or on another device; "
+                      f"not removing any media until it is back.")
+            state.vanished.clear()
+        
+        for directory, mtime in list(state.dir_mtimes.items()):
+            try:
+                current_mtime = os.stat(directory).st_mtime
+            except OSError:
+                if not state.root_available:
+                    continue  # Checked again once the media directory is back
+                # Deleted or renamed away; everything indexed under it is a removal or move candidate
+                del state.dir_mtimes[directory]
+                if directory != media_path:
+                    self._mark_vanished(state, directory)
+                continue
+            if current_mtime != mtime and directory not in state.hot_dirs:
+                state.hot_dirs.append(directory)
+        
+        if state.pass_started is None and os.path.isdir(media_path):
+            pass_due = (state.last_pass_completed is None or
+                        time.time() - state.last_pass_completed >= app.config['SCAN_INTERVAL'])
+            if pass_due:
+                state.pending_dirs.append(media_path)
+                state.pass_started = time.time()
+                state.pass_dirs_seen = 0
+                state.pass_files_seen = 0
+                state.pass_files_done = 0
+    
+    def _open_next_dir(self, state):
+        """Move the cursor to the next directory, hot ones first; returns False when out of work"""
+        if state.current_files and not state.current_dir_hot:
+            # Set the pass directory aside and come back to it once the changes are handled
+            state.suspended = (state.current_dir, state.current_files, state.current_known)
+        
+        while state.hot_dirs:
+            if self._list_dir(state, state.hot_dirs.popleft(), hot=True):
+                return True
+        
+        if state.suspended:
+            state.current_dir, state.current_files, state.current_known = state.suspended
+            state.current_dir_hot = False
+            state.suspended = None
+            return True
+        
+        while state.pending_dirs:
+            if self._list_dir(state, state.pending_dirs.popleft(), hot=False):
+                return True
+        
+        state.current_dir = None
+        state.current_files = deque()
+        return False
     
-    total_added = 0
-    # Scan each user's directory
-    for username in usernames:
+    def _list_dir(self, state, directory, hot):
+        """Make directory the cursor position; returns False if it can no longer be read"""
+        try:
+            mtime = os.stat(directory).st_mtime
+            entries = list(os.scandir(directory))
+        except OSError:
+            state.dir_mtimes.pop(directory, None)
+            return False
+        
+        # An empty media root is more likely an unmounted disk than a deleted gallery
+        if state.root_available and (entries or directory != self._media_root(state)):
+            self._find_vanished(state, directory, {entry.name for entry in entries})
+        
+        files = []
+        for entry in sorted(entries, key=lambda e: e.name):
+            if entry.is_dir(follow_symlinks=False):
+                # A hot visit only follows new subdirectories; known ones are watched by mtime
+                if not hot:
+                    state.pending_dirs.append(entry.path)
+                elif entry.path not in state.dir_mtimes:
+                    state.hot_dirs.append(entry.path)
+            elif entry.is_file() and allowed_file(entry.name):
+                files.append(entry.path)
+        
+        # One query per directory instead of one per file
+        with db_lock:
+            conn = sqlite3.connect('gallery.db', timeout=10.0)
+            c = conn.cursor()
+            c.execute('''SELECT filepath, thumbnail_path, inode, perceptual_hash, phash_pending FROM media
+                         WHERE filepath IN (SELECT value FROM json_each(?))''',
+                      (json.dumps(files),))
+            state.current_known = {row[0]: row[1:] for row in c.fetchall()}
+            conn.close()
+        
+        state.dir_mtimes[directory] = mtime
+        state.current_dir = directory
+        state.current_dir_hot = hot
+        state.current_files = deque(files)
+        if not hot:
+            state.pass_dirs_seen += 1
+            state.pass_files_seen += len(files)
+        return True
+    
+    def _media_root(self, state):
+        media_path, _ = get_user_storage_paths(
+            state.username,
+            app.config['BASE_MEDIA_PATH'],
+            app.config['BASE_THUMBNAIL_PATH']
+        )
+        return media_path
+    
+    def _find_vanished(self, state, directory, names):
+        """Queue rows for files and subdirectories of directory that are no longer on disk"""
+        prefix = os.path.join(directory, '')
+        with db_lock:
+            conn = sqlite3.connect('gallery.db', timeout=10.0)
+            c = conn.cursor()
+            # One range scan on the filepath index yields each direct child name with rows under it
+            c.execute('''SELECT DISTINCT CASE WHEN instr(rel, ?) = 0 THEN rel ELSE substr(rel, 1, instr(rel, ?) - 1) END
+                         FROM (SELECT substr(filepath, ?) AS rel FROM media
+                               WHERE filepath >= ? AND filepath < ? AND owner_username = ?)''',
+                      (os.sep, os.sep, len(prefix) + 1, prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1), state.username))
+            missing = [row[0] for row in c.fetchall() if row[0] not in names]
+            conn.close()
+        for name in missing:
+            self._mark_vanished(state, os.path.join(directory, name))
+    
+    def _mark_vanished(self, state, path):
+        """Queue the row for path, or every row under it if it was a directory"""
+        prefix = os.path.join(path, '')
+        with db_lock:
+            conn = sqlite3.connect('gallery.db', timeout=10.0)
+            c = conn.cursor()
+            c.execute('''SELECT id, filepath FROM media
+                         WHERE owner_username = ? AND (filepath = ? OR (filepath >= ? AND filepath < ?))''',
+                      (state.username, path, prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)))
+            state.vanished.update(dict(c.fetchall()))
+            conn.close()
+    
+    def _match_moved_file(self, state, filepath, exclude_ids):
+        """Find the row of a vanished file that filepath is a move of, by size plus inode or content hash.
+
+        Returns (media_id, inode, content_hash) or None.
+        """
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        with db_lock:
+            conn = sqlite3.connect('gallery.db', timeout=10.0)
+            c = conn.cursor()
+            c.execute('SELECT id, filepath, inode, content_hash FROM media WHERE owner_username = ? AND size = ?',
+                      (state.username, stat.st_size))
+            candidates = [row for row in c.fetchall()
+                          if row[0] not in exclude_ids and row[1] != filepath and not os.path.exists(row[1])]
+            conn.close()
+        if not candidates:
+            return None
+        
+        content_hash = None
+        if any(row[3] for row in candidates):
+            content_hash = compute_file_hash(filepath)
+        for media_id, _, inode, candidate_hash in candidates:
+            if candidate_hash:
+                # A recycled inode must not pass for a move, so trust the hash when there is one
+                if candidate_hash == content_hash:
+                    return media_id, stat.st_ino, content_hash
+            elif inode == stat.st_ino:
+                return media_id, stat.st_ino, content_hash
+        return None
+    
+    def _reconcile(self, state):
+        """Delete rows whose files are still gone once the queue is drained and moves have matched.
+
+        Removing a large share of the gallery at once waits for confirm_removals; until then the
+        rows are kept and found again by the next full pass.
+        """
+        if not state.vanished or not state.root_available:
+            state.vanished.clear()
+            return
+        ids = list(state.vanished)
+        state.vanished.clear()
+        with db_lock:
+            conn = sqlite3.connect('gallery.db', timeout=10.0)
+            c = conn.cursor()
+            # Re-read paths: rows matched as moves have been updated in the meantime
+            c.execute('SELECT id, filepath, thumbnail_path FROM media WHERE id IN (SELECT value FROM json_each(?))',
+                      (json.dumps(ids),))
+            gone = [row for row in c.fetchall() if not os.path.exists(row[1])]
+            c.execute('SELECT COUNT(*) FROM media WHERE owner_username = ?', (state.username,))
+            total = c.fetchone()[0]
+            limit = max(app.config['RECONCILE_MIN_ROWS'], int(total * app.config['RECONCILE_MAX_FRACTION']))
+            if len(gone) > limit:
+                if not state.removals_confirmed:
+                    conn.close()
+                    if state.held_removals != len(gone):
+                        print(f"Scan for {state.username}: {len(gone)} of {total} media files are gone from disk; "
+                              f"keeping them until an admin confirms the removal.")
+                    state.held_removals = len(gone)
+                    return
+                state.held_removals = 0
+                state.removals_confirmed = False
+            if gone:
+                c.execute('DELETE FROM media WHERE id IN (SELECT value FROM json_each(?))',
+                          (json.dumps([row[0] for row in gone]),))
+                conn.commit()
+                remove_media_thumbnails(c, [(row[0], row[2]) for row in gone])
+            conn.close()
+        if gone:
+            state.removed += len(gone)
+            print(f"Scan for {state.username}: removed {len(gone)} media files no longer on disk.")
+    
+    def _scan_user(self, state, deadline):
+        """Process the user's queue until the deadline; returns the batch of database writes"""
         media_path, thumbnail_path = get_user_storage_paths(
-            username, 
-            app.config['BASE_MEDIA_PATH'], 
+            state.username,
+            app.config['BASE_MEDIA_PATH'],
             app.config['BASE_THUMBNAIL_PATH']
         )
+        os.makedirs(thumbnail_path, exist_ok=True)
+        batch_operations = []
+        moved_ids = set()  # Rows already claimed by a move in this uncommitted batch
+        moved_paths = set()  # Their new paths; a directory can be listed both hot and in the pass
         
-        media_dir = Path(media_path)
-        if not media_dir.exists():
-            continue
+        while time.time() < deadline:
+            # Changed directories preempt the pass cursor
+            if not state.current_files or (state.hot_dirs and not state.current_dir_hot):
+                if not self._open_next_dir(state):
+                    break
+                continue  # The directory may have no media files
+            filepath = state.current_files.popleft()
+            if not state.current_dir_hot:
+                state.pass_files_done += 1
+            media_type = get_media_type(os.path.basename(filepath))
             
-        added_count = 0
-        updated_count = 0
-        batch_operations = []  # Store operations to batch commit
-        
-        for file_path in media_dir.rglob('*'):
-            if added_count + updated_count > 100:
-                break
-            if file_path.is_file() and allowed_file(file_path.name):
-                filepath_str = str(file_path)
-                media_type = get_media_type(file_path.name)
-                if not media_type:
+            if filepath not in state.current_known:
+                if filepath in moved_paths:
+                    continue
+                # A moved or renamed file keeps its row and thumbnail
+                moved = self._match_moved_file(state, filepath, moved_ids)
+                if moved:
+                    media_id, inode, content_hash = moved
+                    moved_ids.add(media_id)
+                    moved_paths.add(filepath)
+                    state.vanished.pop(media_id, None)
+                    batch_operations.append(('MOVE', media_id, os.path.basename(filepath), filepath,
+                                             get_media_folder(media_path, filepath), inode, content_hash))
+                    state.moved += 1
                     continue
-                
-                # Generate thumbnail path
-                thumbnail_filename = f"{file_path.stem}_thumb.jpg"
-                user_thumbnail_path = os.path.join(thumbnail_path, thumbnail_filename)
-                
-                # Ensure thumbnail directory exists
-                os.makedirs(thumbnail_path, exist_ok=True)
-                
-                # Check if already in database (with lock for thread safety)
-                with db_lock:
-                    conn = sqlite3.connect('gallery.db', timeout=10.0)
-                    c = conn.cursor()
-                    c.execute('SELECT id, thumbnail_path FROM media WHERE filepath = ?', (filepath_str,))
-                    existing_record = c.fetchone()
-                    conn.close()
-                
-                if existing_record is None:
-                    # New file - prepare for insertion
-                    created_at = None
-                    if media_type == 'video':
-                        created_at = get_video_creation_time(filepath_str)
-                    else:
-                        created_at = datetime.fromtimestamp(file_path.stat().st_mtime)
-                    size = file_path.stat().st_size
-                    
-                    # Generate thumbnail
-                    if not os.path.exists(user_thumbnail_path):
-                        generate_thumbnail(filepath_str, media_type, user_thumbnail_path)
-                    
-                    # Add to batch operations
-                    batch_operations.append(('INSERT', file_path.name, filepath_str, media_type, created_at, size, user_thumbnail_path, username))
-                    added_count += 1
-                else:
-                    # File exists in database - check if thumbnail needs to be regenerated
-                    existing_thumbnail_path = existing_record[1]
-                    thumbnail_missing = not existing_thumbnail_path or not os.path.exists(existing_thumbnail_path)
-                    
-                    if thumbnail_missing:
-                        # Regenerate thumbnail
-                        generate_thumbnail(filepath_str, media_type, user_thumbnail_path)
-                        # Add to batch operations
-                        batch_operations.append(('UPDATE', user_thumbnail_path, filepath_str))
-                        updated_count += 1
-        
-        # Commit batch operations
-        if batch_operations:
-            with db_lock:
-                conn = sqlite3.connect('gallery.db', timeout=10.0)
-                c = conn.cursor()
                 try:
-                    for op in batch_operations:
+                    row = import_media_file(filepath, thumbnail_path)
+                except ProcessingBusy:
+                    # Processing capacity is exhausted; leave the file for the next pass
+                    state.deferred += 1
+                    continue
+                if row is not None:
+                    batch_operations.append(('INSERT',) + row[:6] + (state.username,) + row[6:] +
+                                            (get_media_folder(media_path, filepath),))
+                    state.added += 1
+            else:
+                existing_thumbnail_path, inode, known_hash, phash_pending = state.current_known[filepath]
+                perceptual_hash = known_hash
+                hashed = False
+                if inode is None:
+                    # Rows from before inodes were recorded, so they can be matched if moved later
+                    try:
+                        batch_operations.append(('INODE', os.stat(filepath).st_ino, filepath))
+                    except OSError:
+                        pass
+                if not existing_thumbnail_path or not os.path.exists(existing_thumbnail_path):
+                    thumbnail_filename = f"{os.path.splitext(os.path.basename(filepath))[0]}_thumb.jpg"
+                    user_thumbnail_path = os.path.join(thumbnail_path, thumbnail_filename)
+                    try:
+                        perceptual_hash = generate_thumbnail(filepath, media_type, user_thumbnail_path)
+                    except ProcessingBusy:
+                        state.deferred += 1
+                        continue
+                    batch_operations.append(('UPDATE', user_thumbnail_path, filepath))
+                    state.regenerated += 1
+                    hashed = media_type == 'image'
+                elif phash_pending:
+                    # Rows from before perceptual hashes were recorded; tried once, since flat, corrupt
+                    # and oversized images never get a hash
+                    try:
+                        perceptual_hash = hash_image_file(filepath)
+                    except ProcessingBusy:
+                        state.deferred += 1
+                        continue
+                    hashed = True
+                if hashed and (perceptual_hash != known_hash or phash_pending):
+                    batch_operations.append(('PHASH', perceptual_hash, filepath))
+        
+        if state.pass_started is not None and not state.pending_dirs and not state.suspended and not (
+                state.current_files and not state.current_dir_hot):
+            state.last_pass_files = state.pass_files_done
+            state.last_pass_completed = time.time()
+            state.pass_started = None
+        
+        return batch_operations
+    
+    def _commit(self, username, batch_operations):
+        with db_lock:
+            conn = sqlite3.connect('gallery.db', timeout=10.0)
+            c = conn.cursor()
+            try:
+                for op in batch_operations:
+                    try:
                         if op[0] == 'INSERT':
-                            _, filename, filepath, file_type, created_at, size, thumb_path, owner = op
-                            c.execute('''INSERT INTO media (filename, filepath, file_type, created_at, size, thumbnail_path, owner_username)
-                                         VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                                     (filename, filepath, file_type, created_at, size, thumb_path, owner))
+                            _, filename, filepath, file_type, created_at, size, thumb_path, owner, content_hash, inode, perceptual_hash, folder = op
+                            c.execute('''INSERT OR IGNORE INTO media (filename, filepath, file_type, created_at, size, thumbnail_path, owner_username,
+                                                                      content_hash, inode, perceptual_hash, folder)
+                                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                                     (filename, filepath, file_type, created_at, size, thumb_path, owner,
+                                      content_hash, inode, perceptual_hash, folder))
                         elif op[0] == 'UPDATE':
                             _, thumb_path, filepath = op
                             c.execute('UPDATE media SET thumbnail_path = ? WHERE filepath = ?', 
                                      (thumb_path, filepath))
-                    conn.commit()
-                except sqlite3.OperationalError as e:
-                    print(f"Database error during scan for {username}: {e}")
-                    conn.rollback()
-                finally:
-                    conn.close()
+                        elif op[0] == 'MOVE':
+                            _, media_id, filename, filepath, folder, inode, content_hash = op
+                            c.execute('''UPDATE media SET filename = ?, filepath = ?, folder = ?, inode = ?,
+                                                          content_hash = COALESCE(?, content_hash)
+                                         WHERE id = ?''',
+                                     (filename, filepath, folder, inode, content_hash, media_id))
+                        elif op[0] == 'INODE':
+                            _, inode, filepath = op
+                            c.execute('UPDATE media SET inode = ? WHERE filepath = ?', (inode, filepath))
+                        elif op[0] == 'PHASH':
+                            _, perceptual_hash, filepath = op
+                            c.execute('UPDATE media SET perceptual_hash = ?, phash_pending = 0 WHERE filepath = ?',
+                                      (perceptual_hash, filepath))
+                    except sqlite3.IntegrityError as e:
+                        # E.g. an upload took the path since it was listed; skip just this write
+                        print(f"Skipped {op[0]} during scan for {username}: {e}")
+                conn.commit()
+            except sqlite3.OperationalError as e:
+                print(f"Database error during scan for {username}: {e}")
+                conn.rollback()
+            finally:
+                conn.close()
+    
+    def run_cycle(self, budget):
+        """Spend up to budget seconds scanning, split evenly between users with work.
+
+        Time a user doesn't need is handed to the others. Returns True if work remains.
+        """
+        self._sync_users()
+        for state in self.users.values():
+            media_path, _ = get_user_storage_paths(
+                state.username,
+                app.config['BASE_MEDIA_PATH'],
+                app.config['BASE_THUMBNAIL_PATH']
+            )
+            self._detect_changes(state, media_path)
+        
+        deadline = time.time() + budget
+        active = [state for state in self.users.values() if state.has_work()]
+        while active and time.time() < deadline:
+            share = (deadline - time.time()) / len(active)
+            for state in list(active):
+                added, regenerated, moved = state.added, state.regenerated, state.moved
+                batch_operations = self._scan_user(state, min(time.time() + share, deadline))
+                if batch_operations:
+                    self._commit(state.username, batch_operations)
+                if state.added > added or state.regenerated > regenerated or state.moved > moved:
+                    print(f"Scan for {state.username}: added {state.added - added} new media files, "
+                          f"regenerated {state.regenerated - regenerated} thumbnails, "
+                          f"matched {state.moved - moved} moved files.")
+                if not state.has_work():
+                    active.remove(state)
         
-        total_added += added_count
-        if added_count > 0 or updated_count > 0:
-            msg = f"Scan completed for {username}."
-            if added_count > 0:
-                msg += f" Added {added_count} new media files."
-            if updated_count > 0:
-                msg += f" Regenerated {updated_count} thumbnails."
-            print(msg)
-    return total_added
+        for state in self.users.values():
+            if state.has_work():
+                continue
+            self._reconcile(state)
+            if time.time() - state.last_thumbnail_gc >= app.config['THUMBNAIL_GC_INTERVAL']:
+                state.last_thumbnail_gc = time.time()
+                _, thumbnail_path = get_user_storage_paths(
+                    state.username,
+                    app.config['BASE_MEDIA_PATH'],
+                    app.config['BASE_THUMBNAIL_PATH']
+                )
+                removed = collect_orphaned_thumbnails(thumbnail_path, app.config['THUMBNAIL_GC_GRACE'])
+                if removed:
+                    print(f"Removed {removed} orphaned thumbnail files for {state.username}.")
+        
+        return any(state.has_work() for state in self.users.values())
+    
+    def confirm_removals(self, username):
+        """Let the next reconcile for username remove more than RECONCILE_MAX_FRACTION of the gallery"""
+        state = self.users.get(username)
+        if state is None or not state.held_removals:
+            return False
+        state.removals_confirmed = True
+        return True
+    
+    def status(self):
+        """Queue depth and catch-up estimates for the admin panel"""
+        users = []
+        for username, state in list(self.users.items()):
+            remaining = state.estimate_remaining_files()
+            rate = None
+            if state.pass_started is not None and state.pass_files_done:
+                rate = state.pass_files_done / max(time.time() - state.pass_started, 0.001)
+            if not remaining:
+                catch_up_seconds = 0
+            elif rate:
+                catch_up_seconds = round(remaining / rate)
+            else:
+                catch_up_seconds = None  # Not enough progress yet to estimate
+            users.append({
+                'username': username,
+                'pending_directories': len(state.pending_dirs),
+                'changed_directories': len(state.hot_dirs),
+                'pending_files': len(state.current_files),
+                'estimated_remaining_files': remaining,
+                'files_per_second': round(rate, 1) if rate else None,
+                'estimated_catch_up_seconds': catch_up_seconds,
+                'files_done_this_pass': state.pass_files_done,
+                'last_pass_completed': datetime.fromtimestamp(state.last_pass_completed).isoformat() if state.last_pass_completed else None,
+                'added': state.added,
+                'regenerated': state.regenerated,
+                'moved': state.moved,
+                'removed': state.removed,
+                'held_removals': state.held_removals,
+                'deferred': state.deferred
+            })
+        estimates = [u['estimated_catch_up_seconds'] for u in users]
+        return {
+            'queue_depth': sum(u['pending_directories'] + u['changed_directories'] for u in users),
+            'estimated_remaining_files': sum(u['estimated_remaining_files'] for u in users),
+            # Users share each cycle, so everyone is caught up when the slowest one is
+            'estimated_catch_up_seconds': None if None in estimates else max(estimates, default=0),
+            'users': users
+        }
+
+scan_scheduler = ScanScheduler()
 
 def periodic_scan():
-    """Periodically scan the media directory"""
+    """Run budgeted scan cycles: back to back while catching up, otherwise polling for changes"""
     while True:
-        if scan_media_directory() == 0:
-            time.sleep(app.config['SCAN_INTERVAL'])
+        try:
+            busy = scan_scheduler.run_cycle(app.config['SCAN_CYCLE_BUDGET'])
+        except Exception as e:
+            print(f"Scan cycle failed: {e}")
+            busy = False
+        time.sleep(app.config['SCAN_BUSY_PAUSE'] if busy else app.config['SCAN_POLL_INTERVAL'])
+
+def compute_file_hash(path):
+    """SHA-256 of a file's contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def is_import_running(username):
+    """Check whether a live bulk import process currently owns this user's gallery"""
+    conn = sqlite3.connect('gallery.db', timeout=10.0)
+    c = conn.cursor()
+    try:
+        c.execute('SELECT pid FROM bulk_imports WHERE username = ?', (username,))
+        row = c.fetchone()
+    except sqlite3.OperationalError:
+        row = None  # Table not created yet
+    conn.close()
+    if row is None or row[0] <= 0:
+        return False
+    try:
+        os.kill(row[0], 0)
+        return True
+    except ProcessLookupError:
+        return False  # Stale record from an interrupted import
+    except PermissionError:
+        return True
+
+class ImportProcessingGovernor(ProcessingGovernor):
+    """Governor of a bulk import worker process: decodes draw on one memory budget shared by all workers.
+
+    The in-use counter lives in shared memory, guarded by a multiprocessing condition, so a large
+    image waits for the other workers to free budget instead of each worker getting a fixed slice.
+    An import has no request to answer, so it waits as long as it takes.
+    """
+    
+    def __init__(self, memory_budget, max_subprocesses, decode_condition, memory_in_use):
+        super().__init__(memory_budget, max_subprocesses, None)
+        self._decode_condition = decode_condition
+        self._shared_memory_in_use = memory_in_use
+    
+    @contextmanager
+    def decode(self, estimated_bytes):
+        amount = min(estimated_bytes, self.memory_budget)
+        with self._decode_condition:
+            self._decode_condition.wait_for(lambda: self._shared_memory_in_use.value + amount <= self.memory_budget)
+            self._shared_memory_in_use.value += amount
+        try:
+            yield
+        finally:
+            with self._decode_condition:
+                self._shared_memory_in_use.value -= amount
+                self._decode_condition.notify_all()
+
+def init_import_worker(memory_budget, decode_condition, memory_in_use):
+    """Make the import process's decodes share the import's memory budget with the other workers"""
+    global processing_governor
+    processing_governor = ImportProcessingGovernor(memory_budget, app.config['MAX_MEDIA_SUBPROCESSES'],
+                                                   decode_condition, memory_in_use)
+
+def import_media_file(filepath, thumbnail_path):
+    """Probe, thumbnail and hash one file; returns a media row tuple or None.
+
+    The content hash and inode let the scanner recognise the file if it is moved later;
+    the perceptual hash feeds similar-photo search.
+    """
+    try:
+        filename = os.path.basename(filepath)
+        media_type = get_media_type(filename)
+        stat = os.stat(filepath)
+        if media_type == 'video':
+            created_at = get_video_creation_time(filepath)
         else:
-            time.sleep(10)
+            created_at = datetime.fromtimestamp(stat.st_mtime)
+        
+        thumbnail_filename = f"{os.path.splitext(filename)[0]}_thumb.jpg"
+        user_thumbnail_path = os.path.join(thumbnail_path, thumbnail_filename)
+        if not os.path.exists(user_thumbnail_path):
+            perceptual_hash = generate_thumbnail(filepath, media_type, user_thumbnail_path)
+        elif media_type == 'image':
+            perceptual_hash = hash_image_file(filepath)
+        else:
+            perceptual_hash = None
+        
+        return (filename, filepath, media_type, created_at, stat.st_size, user_thumbnail_path,
+                compute_file_hash(filepath), stat.st_ino, perceptual_hash)
+    except ProcessingBusy:
+        raise
+    except Exception as e:
+        print(f"Error importing {filepath}: {e}")
+        return None
+
+def bulk_import(username, directory=None, workers=None, batch_size=500):
+    """Import a directory tree inside a user's media directory using all cores.
+
+    Rows are committed in large transactions and those commits are the checkpoint, so an
+    interrupted import continues where it stopped when run again. The periodic scanner
+    skips the user while the import runs.
+    
+    The import runs in its own processes, outside the running server's governor: its workers
+    share a PROCESSING_MEMORY_BUDGET of their own.
+    """
+    if username != ADMIN_USERNAME:
+        conn = sqlite3.connect('gallery.db')
+        c = conn.cursor()
+        c.execute('SELECT id FROM users WHERE username = ?', (username,))
+        user_exists = c.fetchone() is not None
+        conn.close()
+        if not user_exists:
+            print(f"User '{username}' not found")
+            return 1
+    
+    media_path, thumbnail_path = get_user_storage_paths(
+        username,
+        app.config['BASE_MEDIA_PATH'],
+        app.config['BASE_THUMBNAIL_PATH']
+    )
+    # Files are indexed in place, so they must live in the user's media directory to be served
+    media_root = os.path.realpath(media_path)
+    real_directory = os.path.realpath(directory or media_path)
+    if os.path.commonpath([real_directory, media_root]) != media_root:
+        print(f"Import directory must be inside {media_path}")
+        return 1
+    if not os.path.isdir(real_directory):
+        print(f"Directory not found: {real_directory}")
+        return 1
+    # Walk below media_path as given, so stored paths match the scanner's and uploads' form
+    # even when the media directory is reached through a symlink
+    directory = os.path.normpath(os.path.join(media_path, os.path.relpath(real_directory, media_root)))
+    os.makedirs(thumbnail_path, exist_ok=True)
+    
+    if is_import_running(username):
+        print(f"An import for {username} is already running")
+        return 1
+    
+    workers = workers or os.cpu_count() or 1
+    conn = sqlite3.connect('gallery.db', timeout=60.0)
+    c = conn.cursor()
+    c.execute('SELECT files_done FROM bulk_imports WHERE username = ?', (username,))
+    previous = c.fetchone()
+    files_done = previous[0] if previous else 0
+    if previous:
+        print(f"Resuming interrupted import for {username} ({files_done} files imported previously)")
+    c.execute('''INSERT OR REPLACE INTO bulk_imports (username, directory, pid, files_done)
+                 VALUES (?, ?, ?, ?)''', (username, directory, os.getpid(), files_done))
+    conn.commit()
+    
+    # Everything already indexed is skipped, which is what makes the import resumable
+    c.execute('SELECT filepath FROM media WHERE owner_username = ?', (username,))
+    existing = {row[0] for row in c.fetchall()}
+    
+    def candidates():
+        for root, dirs, filenames in os.walk(directory):
+            dirs.sort()
+            for filename in sorted(filenames):
+                filepath = os.path.join(root, filename)
+                if allowed_file(filename) and filepath not in existing:
+                    yield filepath
+    
+    print(f"Importing {directory} for {username} with {workers} workers ({len(existing)} files already indexed)")
+    started = time.time()
+    imported = 0
+    failed = 0
+    imported_bytes = 0
+    batch = []
+    
+    def flush():
+        nonlocal files_done
+        c.executemany('''INSERT OR IGNORE INTO media
+                         (filename, filepath, file_type, created_at, size, thumbnail_path, owner_username,
+                          content_hash, inode, perceptual_hash, folder)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                      [row[:6] + (username,) + row[6:] + (get_media_folder(media_path, row[1]),) for row in batch])
+        files_done += len(batch)
+        c.execute('UPDATE bulk_imports SET files_done = ?, updated_at = CURRENT_TIMESTAMP WHERE username = ?',
+                  (files_done, username))
+        conn.commit()
+        batch.clear()
+        elapsed = max(time.time() - started, 0.001)
+        print(f"Imported {imported} files ({imported / elapsed:.1f} files/s, "
+              f"{imported_bytes / elapsed / 1024 / 1024:.1f} MB/s), {failed} failed")
+    
+    # One decode budget for all workers, in shared memory
+    mp_context = multiprocessing.get_context()
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=mp_context,
+        initializer=init_import_worker,
+        initargs=(app.config['PROCESSING_MEMORY_BUDGET'], mp_context.Condition(), mp_context.Value('q', 0, lock=False))
+    )
+    pending = set()
+    interrupted = False
+    try:
+        tasks = candidates()
+        while True:
+            # Keep a bounded number of files in flight rather than queueing the whole tree
+            for filepath in tasks:
+                pending.add(executor.submit(import_media_file, filepath, thumbnail_path))
+                if len(pending) >= workers * 4:
+                    break
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                row = future.result()
+                if row is None:
+                    failed += 1
+                    continue
+                batch.append(row)
+                imported += 1
+                imported_bytes += row[4]
+            if len(batch) >= batch_size:
+                flush()
+    except KeyboardInterrupt:
+        interrupted = True
+        print("Interrupted, saving progress...")
+    finally:
+        executor.shutdown(wait=not interrupted, cancel_futures=True)
+        if batch:
+            flush()
+    
+    if interrupted:
+        # Keep the checkpoint but release the user back to the scanner
+        c.execute('UPDATE bulk_imports SET pid = 0 WHERE username = ?', (username,))
+        conn.commit()
+        conn.close()
+        print("Run the same command again to resume.")
+        return 130
+    
+    c.execute('DELETE FROM bulk_imports WHERE username = ?', (username,))
+    conn.commit()
+    conn.close()
+    elapsed = max(time.time() - started, 0.001)
+    print(f"Import complete: {imported} files in {elapsed:.1f}s "
+          f"({imported / elapsed:.1f} files/s, {imported_bytes / elapsed / 1024 / 1024:.1f} MB/s), {failed} failed")
+    return 0
 
 # Note: Scan initialization moved to if __name__ == '__main__' block
 # after database initialization
 
+# Pages whose asset references are rewritten to fingerprinted names
+STATIC_PAGES = ('index.html', 'admin.html')
+STATIC_ASSET_PATTERN = re.compile(r'(href|src)="([\w.-]+\.(?:css|js))"')
+STATIC_BUILD_NAME_PATTERN = re.compile(r'[\w-]+\.[0-9a-f]{12}\.(?:css|js)')
+STATIC_BUILD_MANIFEST = 'manifest.json'  # Names of the current build's files, in STATIC_BUILD_DIR
+STATIC_BUILD_RETENTION = 86400  # Seconds files of a replaced build are kept for pages loaded before the deploy
+
+static_manifest = None
+static_manifest_lock = threading.Lock()
+
+def write_file_atomically(path, data):
+    """Write bytes so concurrent readers never see a partial file"""
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+def build_static_file(build_dir, name, data, mimetype):
+    """Store one built file plus its gzip/brotli encodings; returns its manifest entry"""
+    path = os.path.join(build_dir, name)
+    encodings = {}
+    if not os.path.exists(path):
+        write_file_atomically(path, data)
+    candidates = [('gzip', '.gz', lambda: gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        candidates.insert(0, ('br', '.br', lambda: brotli.compress(data, quality=11)))
+    for encoding, suffix, compress in candidates:
+        encoded_path = path + suffix
+        if not os.path.exists(encoded_path):
+            encoded = compress()
+            # Tiny files can grow when compressed
+            if len(encoded) >= len(data):
+                continue
+            write_file_atomically(encoded_path, encoded)
+        encodings[encoding] = encoded_path
+    return {'path': path, 'mimetype': mimetype, 'encodings': encodings}
+
+def build_static_assets():
+    """Fingerprint and precompress the assets in static/ and rewrite the pages that use them.
+
+    Asset names carry a hash of their content, so they can be cached forever; the rewritten
+    pages are revalidated on every visit and pick up new names after a deploy. Builds are
+    content-addressed, so several workers building at once write identical files.
+    """
+    static_dir = app.static_folder
+    build_dir = app.config['STATIC_BUILD_DIR']
+    os.makedirs(build_dir, exist_ok=True)
+    
+    assets = {}  # Fingerprinted name -> entry
+    fingerprinted = {}  # Original name -> fingerprinted name
+    for name in sorted(os.listdir(static_dir)):
+        base, ext = os.path.splitext(name)
+        if ext not in ('.css', '.js'):
+            continue
+        with open(os.path.join(static_dir, name), 'rb') as f:
+            data = f.read()
+        hashed_name = f"{base}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+        fingerprinted[name] = hashed_name
+        assets[hashed_name] = build_static_file(build_dir, hashed_name, data, mimetypes.guess_type(name)[0])
+    
+    pages = {}
+    for name in STATIC_PAGES:
+        with open(os.path.join(static_dir, name), encoding='utf-8') as f:
+            html = f.read()
+        html = STATIC_ASSET_PATTERN.sub(
+            lambda m: f'{m.group(1)}="/assets/{fingerprinted[m.group(2)]}"' if m.group(2) in fingerprinted else m.group(0),
+            html)
+        data = html.encode('utf-8')
+        base, ext = os.path.splitext(name)
+        pages[name] = build_static_file(build_dir, f"{base}.{hashlib.sha256(data).hexdigest()[:12]}{ext}",
+                                        data, 'text/html')
+    
+    current = set()
+    for entry in list(assets.values()) + list(pages.values()):
+        current.add(os.path.basename(entry['path']))
+        current.update(os.path.basename(path) for path in entry['encodings'].values())
+    
+    # Files of the build being replaced are touched, so their mtime records when they were retired;
+    # pages clients loaded before the deploy can fetch them for STATIC_BUILD_RETENTION after that
+    manifest_path = os.path.join(build_dir, STATIC_BUILD_MANIFEST)
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            previous = set(json.load(f)['files'])
+    except (OSError, ValueError, KeyError):
+        # No record of the last build: treat everything already there as just retired
+        previous = {name for name in os.listdir(build_dir) if name != STATIC_BUILD_MANIFEST and not name.endswith('.tmp')}
+    for name in previous - current:
+        try:
+            os.utime(os.path.join(build_dir, name))
+        except OSError:
+            pass
+    if previous != current:
+        write_file_atomically(manifest_path, json.dumps({'files': sorted(current)}).encode('utf-8'))
+    
+    cutoff = time.time() - STATIC_BUILD_RETENTION
+    for entry in os.scandir(build_dir):
+        try:
+            if (entry.name not in current and entry.name not in previous and entry.name != STATIC_BUILD_MANIFEST
+                    and entry.stat().st_mtime < cutoff):
+                os.remove(entry.path)
+        except OSError:
+            pass
+    
+    return {'assets': assets, 'pages': pages}
+
+def get_static_manifest():
+    global static_manifest
+    if static_manifest is None:
+        with static_manifest_lock:
+            if static_manifest is None:
+                static_manifest = build_static_assets()
+    return static_manifest
+
+def send_static_build(entry, immutable):
+    """Send a built file, pre-encoded to the best encoding the client accepts"""
+    path, encoding = entry['path'], None
+    for candidate in ('br', 'gzip'):
+        if candidate in entry['encodings'] and request.accept_encodings.quality(candidate) > 0:
+            path, encoding = entry['encodings'][candidate], candidate
+            break
+    
+    response = send_file(path, mimetype=entry['mimetype'])
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    # Caches must keep the encodings apart
+    response.vary.add('Accept-Encoding')
+    response.cache_control.no_cache = None
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+def get_retained_static_asset(name):
+    """Manifest entry for an asset of an earlier build that is still kept, or None"""
+    if not STATIC_BUILD_NAME_PATTERN.fullmatch(name):
+        return None
+    path = os.path.join(app.config['STATIC_BUILD_DIR'], name)
+    if not os.path.isfile(path):
+        return None
+    encodings = {encoding: path + suffix for encoding, suffix in (('br', '.br'), ('gzip', '.gz'))
+                 if os.path.isfile(path + suffix)}
+    return {'path': path, 'mimetype': mimetypes.guess_type(name)[0], 'encodings': encodings}
+
+@app.route('/assets/<name>')
+def get_static_asset(name):
+    entry = get_static_manifest()['assets'].get(name) or get_retained_static_asset(name)
+    if entry is None:
+        return jsonify({'error': 'Not found'}), 404
+    return send_static_build(entry, immutable=True)
+
 @app.route('/')
 def index():
-    return send_from_directory('static', 'index.html')
+    return send_static_build(get_static_manifest()['pages']['index.html'], immutable=False)
 
 @app.route('/api/login', methods=['POST'])
 def login():
@@ -476,6 +1867,23 @@ def get_filter_options():
         'days': days
     })
 
+def build_media_filters(owner_username, year=None, month=None, day=None):
+    """Build WHERE clauses and parameters for an owner's media, optionally narrowed by date"""
+    where_clauses = ["owner_username = ?"]
+    params = [owner_username]
+    
+    if year is not None:
+        where_clauses.append("strftime('%Y', created_at) = ?")
+        params.append(str(year))
+        if month is not None:
+            where_clauses.append("strftime('%m', created_at) = ?")
+            params.append(f"{month:02d}")
+            if day is not None:
+                where_clauses.append("strftime('%d', created_at) = ?")
+                params.append(f"{day:02d}")
+    
+    return where_clauses, params
+
 @app.route('/api/media', methods=['GET'])
 def get_media():
     if 'user_id' not in session:
@@ -505,19 +1913,7 @@ def get_media():
     c = conn.cursor()
     
     # Build WHERE clause for owner and date filtering
-    where_clauses = ["owner_username = ?"]
-    params = [owner_username]
-    
-    if year is not None:
-        where_clauses.append("strftime('%Y', created_at) = ?")
-        params.append(str(year))
-        if month is not None:
-            where_clauses.append("strftime('%m', created_at) = ?")
-            params.append(f"{month:02d}")
-            if day is not None:
-                where_clauses.append("strftime('%d', created_at) = ?")
-                params.append(f"{day:02d}")
-    
+    where_clauses, params = build_media_filters(owner_username, year, month, day)
     where_clause = "WHERE " + " AND ".join(where_clauses)
     
     # Get total count
@@ -527,23 +1923,11 @@ def get_media():
     # Get paginated results
     offset = (page - 1) * per_page
     query_params = params + [per_page, offset]
-    c.execute(f'''SELECT id, filename, filepath, file_type, created_at, uploaded_at, size, thumbnail_path, owner_username
-                 FROM media {where_clause} ORDER BY created_at DESC LIMIT ? OFFSET ?''',
+    c.execute(f'''SELECT {MEDIA_COLUMNS}
+                 FROM media {where_clause} ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?''',
               query_params)
     
-    media_list = []
-    for row in c.fetchall():
-        media_list.append({
-            'id': row[0],
-            'filename': row[1],
-            'filepath': row[2],
-            'file_type': row[3],
-            'created_at': row[4],
-            'uploaded_at': row[5],
-            'size': row[6],
-            'thumbnail_path': row[7],
-            'owner_username': row[8]
-        })
+    media_list = [media_row_to_dict(row) for row in c.fetchall()]
     
     conn.close()
     
@@ -556,6 +1940,87 @@ def get_media():
         'owner_username': owner_username
     })
 
+# Qualified so they can be selected from joins with media_search, whose columns share names
+MEDIA_COLUMNS = ('media.id, media.filename, media.filepath, media.file_type, media.created_at, '
+                 'media.uploaded_at, media.size, media.thumbnail_path, media.owner_username')
+
+def media_row_to_dict(row):
+    """JSON shape of a media row selected with MEDIA_COLUMNS"""
+    return {
+        'id': row[0],
+        'filename': row[1],
+        'filepath': row[2],
+        'file_type': row[3],
+        'created_at': row[4],
+        'uploaded_at': row[5],
+        'size': row[6],
+        'thumbnail_path': row[7],
+        'owner_username': row[8]
+    }
+
+def fetch_media_by_ids(c, media_ids):
+    """Media dicts for the given ids, in the same order"""
+    c.execute(f'SELECT {MEDIA_COLUMNS} FROM media WHERE id IN (SELECT value FROM json_each(?))',
+              (json.dumps(media_ids),))
+    by_id = {row[0]: media_row_to_dict(row) for row in c.fetchall()}
+    return [by_id[media_id] for media_id in media_ids if media_id in by_id]
+
+def build_search_query(text):
+    """FTS5 query requiring every word of text, each matched as a prefix"""
+    terms = [term for term in text.split() if any(ch.isalnum() for ch in term)]
+    return ' '.join('"' + term.replace('"', '""') + '"*' for term in terms)
+
+@app.route('/api/search', methods=['GET'])
+def search_media():
+    """Search a gallery by file name, folder, media type, year and month name.
+
+    Every word has to match the start of a word ("hawa 2019" finds Hawaii 2019/IMG_0001.jpg).
+    Results come newest-indexed first; pass next_cursor back as cursor for the next page.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    current_user = session['username']
+    owner_username = request.args.get('owner', current_user)
+    query = build_search_query(request.args.get('q', ''))
+    if not query:
+        return jsonify({'error': 'Search query is required'}), 400
+    
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    cursor = request.args.get('cursor', type=int)
+    year = request.args.get('year', type=int)
+    month = request.args.get('month', type=int)
+    day = request.args.get('day', type=int)
+    
+    conn = sqlite3.connect('gallery.db')
+    c = conn.cursor()
+    
+    if not has_gallery_access(c, owner_username, current_user):
+        conn.close()
+        return jsonify({'error': 'Access denied'}), 403
+    
+    where_clauses, params = build_media_filters(owner_username, year, month, day)
+    where_clauses.insert(0, 'media_search MATCH ?')
+    params.insert(0, query)
+    if cursor is not None:
+        where_clauses.append('media_search.rowid < ?')
+        params.append(cursor)
+    
+    # Walking the full-text index in rowid order lets LIMIT stop early, however many rows match
+    c.execute(f'''SELECT {MEDIA_COLUMNS} FROM media_search JOIN media ON media.id = media_search.rowid
+                  WHERE {" AND ".join(where_clauses)}
+                  ORDER BY media_search.rowid DESC LIMIT ?''',
+              params + [limit + 1])
+    rows = c.fetchall()
+    conn.close()
+    
+    media_list = [media_row_to_dict(row) for row in rows[:limit]]
+    return jsonify({
+        'media': media_list,
+        'next_cursor': media_list[-1]['id'] if len(rows) > limit else None,
+        'owner_username': owner_username
+    })
+
 @app.route('/api/media/<int:media_id>', methods=['GET'])
 def get_media_file(media_id):
     if 'user_id' not in session:
@@ -582,7 +2047,109 @@ def get_media_file(media_id):
             return jsonify({'error': 'Access denied'}), 403
     
     conn.close()
-    return send_file(filepath)
+    return serve_file(filepath)
+
+@app.route('/api/media/<int:media_id>/neighbors', methods=['GET'])
+def get_media_neighbors(media_id):
+    """Items before and after a media item in gallery order, under the same date filters.
+
+    Seeks from the item's (created_at, id) position in the index, so it costs the same
+    anywhere in a large gallery.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    current_user = session['username']
+    count = max(1, min(request.args.get('count', 5, type=int), 50))
+    year = request.args.get('year', type=int)
+    month = request.args.get('month', type=int)
+    day = request.args.get('day', type=int)
+    
+    conn = sqlite3.connect('gallery.db')
+    c = conn.cursor()
+    c.execute('SELECT created_at, owner_username FROM media WHERE id = ?', (media_id,))
+    media = c.fetchone()
+    
+    if not media:
+        conn.close()
+        return jsonify({'error': 'Media not found'}), 404
+    
+    created_at, owner_username = media
+    
+    if not has_gallery_access(c, owner_username, current_user):
+        conn.close()
+        return jsonify({'error': 'Access denied'}), 403
+    
+    where_clauses, params = build_media_filters(owner_username, year, month, day)
+    where_clause = " AND ".join(where_clauses)
+    
+    # The gallery is newest first, so "next" items are older
+    c.execute(f'''SELECT {MEDIA_COLUMNS} FROM media
+                  WHERE {where_clause} AND (created_at, id) < (?, ?)
+                  ORDER BY created_at DESC, id DESC LIMIT ?''',
+              params + [created_at, media_id, count])
+    next_items = [media_row_to_dict(row) for row in c.fetchall()]
+    
+    c.execute(f'''SELECT {MEDIA_COLUMNS} FROM media
+                  WHERE {where_clause} AND (created_at, id) > (?, ?)
+                  ORDER BY created_at ASC, id ASC LIMIT ?''',
+              params + [created_at, media_id, count])
+    previous_items = [media_row_to_dict(row) for row in reversed(c.fetchall())]
+    
+    conn.close()
+    
+    return jsonify({
+        'previous': previous_items,
+        'next': next_items
+    })
+
+@app.route('/api/media/<int:media_id>/display', methods=['GET'])
+def get_display_media(media_id):
+    """Screen-sized image for the viewer, generated on first use; originals for everything else"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    current_user = session['username']
+    conn = sqlite3.connect('gallery.db')
+    c = conn.cursor()
+    c.execute('SELECT filepath, file_type, thumbnail_path, owner_username FROM media WHERE id = ?', (media_id,))
+    media = c.fetchone()
+    
+    if not media:
+        conn.close()
+        return jsonify({'error': 'Media not found'}), 404
+    
+    filepath, file_type, thumbnail_path, owner_username = media
+    
+    if not has_gallery_access(c, owner_username, current_user):
+        conn.close()
+        return jsonify({'error': 'Access denied'}), 403
+    
+    conn.close()
+    
+    if file_type != 'image' or not thumbnail_path or not os.path.isfile(filepath):
+        return serve_file(filepath)
+    
+    display_path = get_display_rendition_path(thumbnail_path, media_id)
+    # Regenerated if the original was replaced since
+    if not os.path.exists(display_path) or os.path.getmtime(display_path) < os.path.getmtime(filepath):
+        try:
+            os.makedirs(os.path.dirname(display_path), exist_ok=True)
+            if not generate_display_rendition(filepath, display_path):
+                display_path = filepath
+        except ProcessingBusy:
+            return server_busy_response()
+        except Exception as e:
+            print(f"Error generating display image for {filepath}: {e}")
+            display_path = filepath
+    
+    response = serve_file(display_path)
+    if isinstance(response, Response):
+        # Lets the viewer's prefetches be reused without another round trip
+        response.cache_control.no_cache = None
+        response.cache_control.private = True
+        response.cache_control.max_age = app.config['DISPLAY_CACHE_MAX_AGE']
+    return response
 
 @app.route('/api/media/<int:media_id>/thumbnail', methods=['GET'])
 def get_thumbnail(media_id):
@@ -614,7 +2181,606 @@ def get_thumbnail(media_id):
     if not thumbnail_path or not os.path.exists(thumbnail_path):
         return jsonify({'error': 'Thumbnail not found'}), 404
     
-    return send_file(thumbnail_path)
+    return serve_file(thumbnail_path)
+
+def get_offload_uri(filepath):
+    """Map a file to the proxy's internal URI, or None if no offload location contains it"""
+    real_path = os.path.realpath(filepath)
+    for location_path, internal_uri in app.config['OFFLOAD_LOCATIONS']:
+        root = os.path.realpath(location_path)
+        if os.path.commonpath([real_path, root]) == root:
+            relative = os.path.relpath(real_path, root).replace(os.sep, '/')
+            return f"{internal_uri}/{quote(relative)}"
+    return None
+
+def serve_file(filepath, mimetype=None):
+    """Send a file that the caller has already authorized.
+
+    With offload enabled this only returns headers telling nginx (X-Accel-Redirect) or
+    Apache/lighttpd (X-Sendfile) which file to stream, so the worker is freed immediately.
+    """
+    if not os.path.isfile(filepath):
+        # Deleted or moved on disk since the last scan; the scanner reconciles the row
+        return jsonify({'error': 'File not found'}), 404
+    mode = app.config['OFFLOAD_MODE']
+    if mode != 'none':
+        mimetype = mimetype or mimetypes.guess_type(filepath)[0] or 'application/octet-stream'
+        if mode == 'x-sendfile':
+            response = app.response_class(mimetype=mimetype)
+            response.headers[app.config['OFFLOAD_HEADER']] = os.path.realpath(filepath)
+            return response
+        internal_uri = get_offload_uri(filepath)
+        if internal_uri:
+            response = app.response_class(mimetype=mimetype)
+            response.headers['X-Accel-Redirect'] = internal_uri
+            return response
+    return send_file(filepath, mimetype=mimetype)
+
+def server_busy_response(extra=None):
+    """503 response asking the client to retry once processing capacity frees up"""
+    body = {'error': 'Server is busy processing media, please try again shortly'}
+    body.update(extra or {})
+    response = jsonify(body)
+    response.headers['Retry-After'] = str(app.config['PROCESSING_WAIT_TIMEOUT'])
+    return response, 503
+
+def has_gallery_access(c, owner_username, current_user):
+    """Check whether current_user may view owner_username's gallery"""
+    if owner_username == current_user:
+        return True
+    c.execute('SELECT id FROM shares WHERE owner_username = ? AND shared_with_username = ?', 
+              (owner_username, current_user))
+    return c.fetchone() is not None
+
+# One lock per preview being generated, so concurrent requests for the same video don't
+# duplicate ffmpeg work while different videos generate in parallel
+preview_locks = weakref.WeakValueDictionary()
+preview_locks_guard = threading.Lock()
+
+def get_preview_lock(sprite_path):
+    with preview_locks_guard:
+        lock = preview_locks.get(sprite_path)
+        if lock is None:
+            lock = preview_locks[sprite_path] = threading.Lock()
+        return lock
+
+def load_video_preview(media_id):
+    """Return (sprite_path, vtt_path) for a video, generating them on first use.
+
+    On failure returns (None, error_response) so routes can pass the error through.
+    """
+    if 'user_id' not in session:
+        return None, (jsonify({'error': 'Unauthorized'}), 401)
+    
+    current_user = session['username']
+    conn = sqlite3.connect('gallery.db')
+    c = conn.cursor()
+    c.execute('SELECT filepath, file_type, thumbnail_path, owner_username FROM media WHERE id = ?', (media_id,))
+    media = c.fetchone()
+    
+    if not media:
+        conn.close()
+        return None, (jsonify({'error': 'Media not found'}), 404)
+    
+    filepath, file_type, thumbnail_path, owner_username = media
+    
+    if not has_gallery_access(c, owner_username, current_user):
+        conn.close()
+        return None, (jsonify({'error': 'Access denied'}), 403)
+    
+    conn.close()
+    
+    if file_type != 'video' or not thumbnail_path:
+        return None, (jsonify({'error': 'Preview not available'}), 404)
+    
+    sprite_path, vtt_path = get_video_preview_paths(thumbnail_path, media_id)
+    if not (os.path.exists(sprite_path) and os.path.exists(vtt_path)):
+        lock = get_preview_lock(sprite_path)
+        # Another request is generating this preview; don't hold a worker longer than an upload would wait
+        if not lock.acquire(timeout=app.config['PROCESSING_WAIT_TIMEOUT']):
+            return None, server_busy_response()
+        try:
+            if not (os.path.exists(sprite_path) and os.path.exists(vtt_path)):
+                os.makedirs(os.path.dirname(sprite_path), exist_ok=True)
+                try:
+                    generated = generate_video_preview(filepath, sprite_path, vtt_path)
+                except ProcessingBusy:
+                    return None, server_busy_response()
+                if not generated:
+                    return None, (jsonify({'error': 'Preview not available'}), 404)
+        finally:
+            lock.release()
+    
+    return (sprite_path, vtt_path), None
+
+@app.route('/api/media/<int:media_id>/preview.vtt', methods=['GET'])
+def get_video_preview_index(media_id):
+    paths, error = load_video_preview(media_id)
+    if error:
+        return error
+    return serve_file(paths[1], mimetype='text/vtt')
+
+@app.route('/api/media/<int:media_id>/preview.jpg', methods=['GET'])
+def get_video_preview_sprite(media_id):
+    paths, error = load_video_preview(media_id)
+    if error:
+        return error
+    return serve_file(paths[0], mimetype='image/jpeg')
+
+# Bit counts of every byte, for NumPy versions without np.bitwise_count
+POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def hamming_distances(a, b):
+    """Element-wise Hamming distances between broadcastable uint64 hash arrays"""
+    xor = np.bitwise_xor(a, b)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(xor)
+    xor = np.ascontiguousarray(xor)
+    return POPCOUNT_TABLE[xor.view(np.uint8)].reshape(xor.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+class SimilarityIndex:
+    """Perceptual hashes of each owner's images, held as flat NumPy arrays.
+
+    An owner's arrays are reloaded when their phash_generations counter moves, which also
+    picks up rows written by a bulk import in another process. Snapshots are immutable,
+    so searches run outside the lock.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshots = {}  # owner -> (version, ids, hashes, {distance: clusters})
+    
+    def _snapshot(self, c, owner_username):
+        c.execute('SELECT generation FROM phash_generations WHERE owner_username = ?', (owner_username,))
+        version = c.fetchone()
+        with self.lock:
+            snapshot = self.snapshots.get(owner_username)
+            if snapshot is None or snapshot[0] != version:
+                c.execute('''SELECT id, perceptual_hash FROM media
+                             WHERE owner_username = ? AND perceptual_hash IS NOT NULL''', (owner_username,))
+                rows = np.array(c.fetchall(), dtype=np.int64).reshape(-1, 2)
+                snapshot = (version, rows[:, 0].copy(), rows[:, 1].copy().view(np.uint64), {})
+                self.snapshots[owner_username] = snapshot
+        return snapshot
+    
+    def search(self, c, owner_username, perceptual_hash, max_distance, limit):
+        """Ids and distances of the owner's images within max_distance bits, closest first"""
+        _, ids, hashes, _ = self._snapshot(c, owner_username)
+        query = np.array(perceptual_hash, dtype=np.int64).view(np.uint64)
+        distances = hamming_distances(hashes, query)
+        matches = np.flatnonzero(distances <= max_distance)
+        matches = matches[np.lexsort((ids[matches], distances[matches]))][:limit]
+        return list(zip(ids[matches].tolist(), distances[matches].tolist()))
+    
+    def clusters(self, c, owner_username, max_distance):
+        """Groups of the owner's image ids linked by chains of near-identical hashes, largest first"""
+        _, ids, hashes, cache = self._snapshot(c, owner_username)
+        if max_distance in cache:
+            return cache[max_distance]
+        
+        # Hashes within max_distance bits agree exactly on at least one of max_distance + 1 blocks,
+        # so only hashes sharing a block value need comparing
+        blocks = max_distance + 1
+        bounds = [64 * k // blocks for k in range(blocks + 1)]
+        pairs = [np.empty((0, 2), dtype=np.int64)]
+        for start, end in zip(bounds, bounds[1:]):
+            keys = (hashes >> np.uint64(start)) & np.uint64((1 << (end - start)) - 1)
+            order = np.argsort(keys)
+            splits = np.flatnonzero(np.diff(keys[order])) + 1
+            starts = np.concatenate(([0], splits))
+            ends = np.concatenate((splits, [len(order)]))
+            # End of the run of equal block values each sorted position belongs to
+            run_end = np.repeat(ends, ends - starts)
+            # Compare every position with the one `step` places later in its run, for growing
+            # steps, so all pairs within runs are checked without a Python loop per run
+            positions = np.flatnonzero(run_end - np.arange(len(order)) > 1)
+            step = 1
+            while positions.size:
+                a, b = order[positions], order[positions + step]
+                close = hamming_distances(hashes[a], hashes[b]) <= max_distance
+                if close.any():
+                    a, b = a[close], b[close]
+                    pairs.append(np.stack((np.minimum(a, b), np.maximum(a, b)), axis=1))
+                step += 1
+                positions = positions[run_end[positions] - positions > step]
+        
+        # Union-find over the (usually few) images that have a close neighbour
+        parent = {}
+        
+        def find(i):
+            parent.setdefault(i, i)
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+        
+        for x, y in np.unique(np.concatenate(pairs), axis=0).tolist():
+            root_x, root_y = find(x), find(y)
+            if root_x != root_y:
+                parent[root_y] = root_x
+        
+        groups = {}
+        for i in list(parent):
+            groups.setdefault(find(i), []).append(i)
+        result = sorted((sorted(ids[members].tolist()) for members in groups.values()),
+                        key=lambda cluster: (-len(cluster), cluster[0]))
+        cache[max_distance] = result
+        return result
+
+similarity_index = SimilarityIndex()
+
+@app.route('/api/media/<int:media_id>/similar', methods=['GET'])
+def get_similar_media(media_id):
+    """Images that look like this one, closest first"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    current_user = session['username']
+    max_distance = min(request.args.get('distance', 10, type=int), app.config['SIMILAR_MAX_DISTANCE'])
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    
+    conn = sqlite3.connect('gallery.db')
+    c = conn.cursor()
+    c.execute('SELECT owner_username, perceptual_hash FROM media WHERE id = ?', (media_id,))
+    media = c.fetchone()
+    
+    if not media:
+        conn.close()
+        return jsonify({'error': 'Media not found'}), 404
+    
+    owner_username, perceptual_hash = media
+    
+    if not has_gallery_access(c, owner_username, current_user):
+        conn.close()
+        return jsonify({'error': 'Access denied'}), 403
+    
+    if perceptual_hash is None:
+        conn.close()
+        return jsonify({'error': 'Similarity search is not available for this media'}), 404
+    
+    matches = [m for m in similarity_index.search(c, owner_username, perceptual_hash, max_distance, limit + 1)
+               if m[0] != media_id][:limit]
+    distances = dict(matches)
+    media_list = fetch_media_by_ids(c, [m[0] for m in matches])
+    conn.close()
+    
+    for item in media_list:
+        item['distance'] = distances[item['id']]
+    return jsonify({'media': media_list, 'distance': max_distance})
+
+@app.route('/api/duplicates', methods=['GET'])
+def get_duplicate_clusters():
+    """Clusters of near-duplicate images in a gallery, largest first"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    current_user = session['username']
+    owner_username = request.args.get('owner', current_user)
+    max_distance = request.args.get('distance', app.config['DUPLICATE_DISTANCE'], type=int)
+    max_distance = max(0, min(max_distance, app.config['DUPLICATE_MAX_DISTANCE']))
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = max(min(request.args.get('per_page', 20, type=int), 100), 1)
+    
+    conn = sqlite3.connect('gallery.db')
+    c = conn.cursor()
+    
+    if not has_gallery_access(c, owner_username, current_user):
+        conn.close()
+        return jsonify({'error': 'Access denied'}), 403
+    
+    clusters = similarity_index.clusters(c, owner_username, max_distance)
+    offset = (page - 1) * per_page
+    page_clusters = [{'media': fetch_media_by_ids(c, cluster)} for cluster in clusters[offset:offset + per_page]]
+    conn.close()
+    
+    total = len(clusters)
+    return jsonify({
+        'clusters': page_clusters,
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'total_pages': (total + per_page - 1) // per_page,
+        'distance': max_distance,
+        'owner_username': owner_username
+    })
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FLAGS = 0x0808  # Data descriptor follows each file (bit 3), UTF-8 names (bit 11)
+
+def zip_dos_datetime(timestamp):
+    """Convert a Unix timestamp to the (time, date) pair stored in ZIP headers"""
+    dt = datetime.fromtimestamp(timestamp)
+    if dt.year < 1980:
+        dt = datetime(1980, 1, 1)
+    return (dt.hour << 11) | (dt.minute << 5) | (dt.second // 2), ((dt.year - 1980) << 9) | (dt.month << 5) | dt.day
+
+class StreamingZip:
+    """A stored (uncompressed) ZIP archive streamed straight from the source files.
+
+    File sizes are taken from stat up front, so every offset and the total length are
+    known before any data is read. That gives a Content-Length and lets a download
+    resume from any byte offset; CRCs travel in data descriptors after each file.
+    
+    Files whose CRC is already known are only read for the requested bytes. CRCs that
+    had to be computed are collected in computed_crcs (entry index -> CRC) for the
+    caller to store.
+    """
+    
+    def __init__(self, files, chunk_size):
+        """files is a list of (archive_name, filepath, size, mtime, crc) tuples; crc may be None"""
+        self.chunk_size = chunk_size
+        self.entries = []
+        self.computed_crcs = {}
+        offset = 0
+        central_directory_size = 0
+        for index, (arcname, filepath, size, mtime, crc) in enumerate(files):
+            entry = {
+                'index': index,
+                'name': arcname.encode('utf-8'),
+                'filepath': filepath,
+                'size': size,
+                'crc': crc,
+                'dos_time': zip_dos_datetime(mtime),
+                'offset': offset,
+                'zip64': size >= ZIP64_LIMIT
+            }
+            entry['header'] = self._local_header(entry)
+            entry['data_offset'] = offset + len(entry['header'])
+            entry['descriptor_offset'] = entry['data_offset'] + size
+            offset = entry['end'] = entry['descriptor_offset'] + (24 if entry['zip64'] else 16)
+            central_directory_size += len(self._central_header(entry, 0))
+            self.entries.append(entry)
+        
+        self.central_directory_offset = offset
+        self.central_directory_size = central_directory_size
+        self.total_size = offset + central_directory_size + len(self._end_records())
+    
+    def _local_header(self, entry):
+        time_, date_ = entry['dos_time']
+        if entry['zip64']:
+            extra = struct.pack('<HHQQ', 0x0001, 16, entry['size'], entry['size'])
+            sizes = (ZIP64_LIMIT, ZIP64_LIMIT)
+        else:
+            extra = b''
+            sizes = (entry['size'], entry['size'])
+        return struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if entry['zip64'] else 20, ZIP_FLAGS, 0,
+                           time_, date_, 0, sizes[0], sizes[1], len(entry['name']), len(extra)) + entry['name'] + extra
+    
+    def _descriptor(self, entry, crc):
+        if entry['zip64']:
+            return struct.pack('<IIQQ', 0x08074b50, crc, entry['size'], entry['size'])
+        return struct.pack('<IIII', 0x08074b50, crc, entry['size'], entry['size'])
+    
+    def _central_header(self, entry, crc):
+        time_, date_ = entry['dos_time']
+        zip64_fields = []
+        size = entry['size']
+        offset = entry['offset']
+        if size >= ZIP64_LIMIT:
+            zip64_fields += [size, size]
+            size = ZIP64_LIMIT
+        if offset >= ZIP64_LIMIT:
+            zip64_fields.append(offset)
+            offset = ZIP64_LIMIT
+        extra = b''
+        if zip64_fields:
+            extra = struct.pack(f'<HH{len(zip64_fields)}Q', 0x0001, 8 * len(zip64_fields), *zip64_fields)
+        version = 45 if extra else 20
+        return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, ZIP_FLAGS, 0,
+                           time_, date_, crc, size, size, len(entry['name']), len(extra), 0, 0, 0,
+                           0o100644 << 16, offset) + entry['name'] + extra
+    
+    def _end_records(self):
+        count = len(self.entries)
+        records = b''
+        if count >= 0xFFFF or self.central_directory_offset >= ZIP64_LIMIT or self.central_directory_size >= ZIP64_LIMIT:
+            zip64_end_offset = self.central_directory_offset + self.central_directory_size
+            records += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, (3 << 8) | 45, 45, 0, 0, count, count,
+                                   self.central_directory_size, self.central_directory_offset)
+            records += struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1)
+        records += struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                               min(self.central_directory_size, ZIP64_LIMIT),
+                               min(self.central_directory_offset, ZIP64_LIMIT), 0)
+        return records
+    
+    def _read_file(self, entry, skip=0):
+        """Yield the file's data from byte skip in chunks, failing if it no longer matches the size in the layout"""
+        remaining = entry['size'] - skip
+        with open(entry['filepath'], 'rb') as f:
+            f.seek(skip)
+            while remaining > 0:
+                chunk = f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    raise IOError(f"{entry['filepath']} changed during export")
+                remaining -= len(chunk)
+                yield chunk
+    
+    def _remember_crc(self, entry, crc):
+        entry['crc'] = crc
+        self.computed_crcs[entry['index']] = crc
+    
+    def _entry_crc(self, entry):
+        """The entry's CRC, reading the whole file if it isn't known yet"""
+        if entry['crc'] is None:
+            crc = 0
+            for chunk in self._read_file(entry):
+                crc = zlib.crc32(chunk, crc)
+            self._remember_crc(entry, crc)
+        return entry['crc']
+    
+    def stream(self, start=0, stop=None):
+        """Yield the archive bytes in [start, stop)"""
+        stop = self.total_size if stop is None else stop
+        for block in self._blocks(start, stop):
+            if block:
+                yield block
+    
+    def _blocks(self, start, stop):
+        def clip(data, data_offset):
+            # Trim a block at data_offset to the requested byte range
+            begin = max(start - data_offset, 0)
+            end = min(stop - data_offset, len(data))
+            return data[begin:end] if begin < end else b''
+        
+        for entry in self.entries:
+            if entry['offset'] >= stop:
+                break
+            if entry['end'] <= start:
+                # Entirely before the range; its CRC is only needed for the central directory
+                continue
+            yield clip(entry['header'], entry['offset'])
+            # An unknown CRC covers the whole file, so skipped leading bytes are still read (not sent)
+            known = entry['crc'] is not None
+            skip = min(max(start - entry['data_offset'], 0), entry['size']) if known else 0
+            crc = 0
+            position = entry['data_offset'] + skip
+            for chunk in self._read_file(entry, skip):
+                if not known:
+                    crc = zlib.crc32(chunk, crc)
+                if position + len(chunk) > start and position < stop:
+                    yield clip(chunk, position)
+                position += len(chunk)
+                if position >= stop:
+                    break
+            if position < entry['descriptor_offset']:
+                return
+            if not known:
+                self._remember_crc(entry, crc)
+            yield clip(self._descriptor(entry, entry['crc']), entry['descriptor_offset'])
+        
+        if self.central_directory_offset >= stop:
+            return
+        position = self.central_directory_offset
+        for entry in self.entries:
+            header_size = len(self._central_header(entry, 0))
+            if position + header_size > start and position < stop:
+                # Files not streamed in this request (resumed download) are read only if their CRC isn't stored
+                yield clip(self._central_header(entry, self._entry_crc(entry)), position)
+            position += header_size
+        yield clip(self._end_records(), position)
+
+@app.route('/api/export', methods=['GET'])
+def export_media():
+    """Stream a ZIP of selected media, a date range, or a whole gallery.
+
+    Query parameters: owner, ids (comma separated), from/to (YYYY-MM-DD, inclusive),
+    and the year/month/day filters used by /api/media. Supports Range/If-Range resumes.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    current_user = session['username']
+    owner_username = request.args.get('owner', current_user)
+    
+    where_clauses, params = build_media_filters(
+        owner_username,
+        request.args.get('year', type=int),
+        request.args.get('month', type=int),
+        request.args.get('day', type=int)
+    )
+    
+    ids = request.args.get('ids')
+    if ids:
+        try:
+            id_list = [int(media_id) for media_id in ids.split(',') if media_id.strip()]
+        except ValueError:
+            return jsonify({'error': 'ids must be a comma separated list of media ids'}), 400
+        where_clauses.append('id IN (SELECT value FROM json_each(?))')
+        params.append(json.dumps(id_list))
+    
+    try:
+        date_from = request.args.get('from')
+        if date_from:
+            where_clauses.append('created_at >= ?')
+            params.append(datetime.strptime(date_from, '%Y-%m-%d').strftime('%Y-%m-%d'))
+        date_to = request.args.get('to')
+        if date_to:
+            where_clauses.append('created_at < ?')
+            params.append((datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d'))
+    except ValueError:
+        return jsonify({'error': 'Dates must use the YYYY-MM-DD format'}), 400
+    
+    conn = sqlite3.connect('gallery.db')
+    c = conn.cursor()
+    
+    if not has_gallery_access(c, owner_username, current_user):
+        conn.close()
+        return jsonify({'error': 'Access denied'}), 403
+    
+    c.execute(f'SELECT id, filename, filepath, crc32, crc32_key FROM media WHERE {" AND ".join(where_clauses)} ORDER BY created_at, id',
+              params)
+    rows = c.fetchall()
+    conn.close()
+    
+    # Keep the owner's folder structure inside the archive when possible
+    media_root, _ = get_user_storage_paths(owner_username, app.config['BASE_MEDIA_PATH'], app.config['BASE_THUMBNAIL_PATH'])
+    files = []
+    file_keys = []
+    used_names = set()
+    etag_source = hashlib.sha1(owner_username.encode('utf-8'))
+    for media_id, filename, filepath, crc, crc_key in rows:
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            continue  # File vanished from disk
+        
+        if os.path.commonpath([os.path.abspath(filepath), media_root]) == media_root:
+            arcname = os.path.relpath(filepath, media_root).replace(os.sep, '/')
+        else:
+            arcname = filename
+        base_name, ext = os.path.splitext(arcname)
+        counter = 1
+        while arcname in used_names:
+            arcname = f"{base_name}_{counter}{ext}"
+            counter += 1
+        used_names.add(arcname)
+        
+        # A stored CRC is reused only while the file's size and mtime are unchanged
+        file_key = f"{stat.st_size}:{stat.st_mtime_ns}"
+        files.append((arcname, filepath, stat.st_size, stat.st_mtime, crc if crc_key == file_key else None))
+        file_keys.append((media_id, file_key))
+        etag_source.update(f"{media_id}:{arcname}:{stat.st_size}:{stat.st_mtime_ns}\n".encode('utf-8'))
+    
+    if not files:
+        return jsonify({'error': 'No media to export'}), 404
+    
+    archive = StreamingZip(files, app.config['EXPORT_CHUNK_SIZE'])
+    etag = etag_source.hexdigest()
+    
+    status = 200
+    start, stop = 0, archive.total_size
+    # Only resume if the client's partial download came from this exact archive
+    if request.range and ('If-Range' not in request.headers or request.if_range.etag == etag):
+        byte_range = request.range.range_for_length(archive.total_size)
+        if byte_range is None:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f"bytes */{archive.total_size}"
+            return response
+        start, stop = byte_range
+        status = 206
+    
+    def stream_archive():
+        try:
+            yield from archive.stream(start, stop)
+        finally:
+            # Store CRCs computed while streaming so resumed and repeated exports skip re-reading
+            if archive.computed_crcs:
+                conn = sqlite3.connect('gallery.db', timeout=10.0)
+                conn.executemany('UPDATE media SET crc32 = ?, crc32_key = ? WHERE id = ?',
+                                 [(crc, file_keys[index][1], file_keys[index][0])
+                                  for index, crc in archive.computed_crcs.items()])
+                conn.commit()
+                conn.close()
+    
+    response = Response(stream_archive(), status=status, mimetype='application/zip',
+                        direct_passthrough=True)
+    response.headers['Content-Length'] = str(stop - start)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['ETag'] = f'"{etag}"'
+    response.headers['Content-Disposition'] = f'attachment; filename="{secure_filename(owner_username) or "gallery"}-export.zip"'
+    if status == 206:
+        response.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{archive.total_size}"
+    return response
 
 @app.route('/api/upload', methods=['POST'])
 def upload_files():
@@ -644,6 +2810,7 @@ def upload_files():
     os.makedirs(thumbnail_path, exist_ok=True)
     
     uploaded_files = []
+    busy = False
     conn = sqlite3.connect('gallery.db')
     c = conn.cursor()
     
@@ -675,24 +2842,35 @@ def upload_files():
             # Generate thumbnail
             thumbnail_filename = f"{os.path.splitext(filename)[0]}_thumb.jpg"
             user_thumbnail_path = os.path.join(thumbnail_path, thumbnail_filename)
-            generate_thumbnail(filepath, media_type, user_thumbnail_path)
+            perceptual_hash = generate_thumbnail(filepath, media_type, user_thumbnail_path)
             
             # Add to database with owner
-            c.execute('''INSERT INTO media (filename, filepath, file_type, created_at, size, thumbnail_path, owner_username)
-                         VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                     (filename, filepath, media_type, created_at, size, user_thumbnail_path, current_user))
+            c.execute('''INSERT INTO media (filename, filepath, file_type, created_at, size, thumbnail_path, owner_username,
+                                            content_hash, inode, perceptual_hash, folder)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, '')''',
+                     (filename, filepath, media_type, created_at, size, user_thumbnail_path, current_user,
+                      compute_file_hash(filepath), stat.st_ino, perceptual_hash))
             
             uploaded_files.append({
                 'filename': filename,
                 'file_type': media_type,
                 'size': size
             })
+        except ProcessingBusy:
+            # Don't keep a file we couldn't process; the client retries the rest
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            busy = True
+            break
         except Exception as e:
             print(f"Error uploading file {filename}: {e}")
     
     conn.commit()
     conn.close()
     
+    if busy:
+        return server_busy_response({'uploaded': uploaded_files})
+    
     return jsonify({'success': True, 'uploaded': uploaded_files})
 
 @app.route('/api/galleries', methods=['GET'])
@@ -795,7 +2973,7 @@ def unshare_gallery():
 @app.route('/admin')
 def admin_page():
     """Admin page route"""
-    return send_from_directory('static', 'admin.html')
+    return send_static_build(get_static_manifest()['pages']['admin.html'], immutable=False)
 
 @app.route('/api/admin/users', methods=['GET'])
 def get_all_users():
@@ -817,6 +2995,33 @@ def get_all_users():
     
     return jsonify({'users': users})
 
+@app.route('/api/admin/processing', methods=['GET'])
+def get_processing_status():
+    """Get media processing budget usage (admin only)"""
+    if 'user_id' not in session or not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify(processing_governor.stats())
+
+@app.route('/api/admin/scan-status', methods=['GET'])
+def get_scan_status():
+    """Get scanner queue depth and catch-up estimates (admin only)"""
+    if 'user_id' not in session or not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify(scan_scheduler.status())
+
+@app.route('/api/admin/scan/<username>/confirm-removals', methods=['POST'])
+def confirm_scan_removals(username):
+    """Allow the scanner to remove a held-back batch of missing files (admin only)"""
+    if 'user_id' not in session or not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if not scan_scheduler.confirm_removals(username):
+        return jsonify({'error': 'No removals are waiting for confirmation'}), 404
+    
+    return jsonify({'success': True, 'message': 'Missing files will be removed after the next full scan'})
+
 @app.route('/api/admin/users', methods=['POST'])
 def create_user():
     """Create a new user (admin only)"""
@@ -881,19 +3086,37 @@ def delete_user(username):
     # Delete user's shares
     c.execute('DELETE FROM shares WHERE owner_username = ? OR shared_with_username = ?', (username, username))
     
-    # Delete user's media records (files remain on disk)
+    # Delete user's media records (files remain on disk) and their thumbnails
+    c.execute('SELECT id, thumbnail_path FROM media WHERE owner_username = ?', (username,))
+    deleted_rows = c.fetchall()
     c.execute('DELETE FROM media WHERE owner_username = ?', (username,))
     
     # Delete user
     c.execute('DELETE FROM users WHERE username = ?', (username,))
     conn.commit()
+    remove_media_thumbnails(c, deleted_rows)
     conn.close()
     
     return jsonify({'success': True, 'message': f'User {username} deleted successfully'})
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Personal Gallery server')
+    subparsers = parser.add_subparsers(dest='command')
+    import_parser = subparsers.add_parser('import', help="Bulk import a directory tree into a user's gallery")
+    import_parser.add_argument('username', help='Gallery owner')
+    import_parser.add_argument('directory', nargs='?', help="Directory inside the user's media path (default: all of it)")
+    import_parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes (default: all cores)')
+    import_parser.add_argument('--batch-size', type=int, default=500, help='Rows per database transaction')
+    args = parser.parse_args()
+    
     init_db()
     
+    if args.command == 'import':
+        sys.exit(bulk_import(args.username, args.directory, args.workers, args.batch_size))
+    
+    # Fingerprint and precompress static assets before the first visitor needs them
+    get_static_manifest()
+    
     # Ensure directories exist for all existing users in database
     conn = sqlite3.connect('gallery.db')
     c = conn.cursor()
@@ -65,6 +65,165 @@ function renderUsers(users) {
     usersList.appendChild(ul);
 }
 
+// Format a byte count for display
+function formatBytes(bytes) {
+    const units = ['B', 'KB', 'MB', 'GB'];
+    let value = bytes;
+    let unit = 0;
+    while (value >= 1024 && unit < units.length - 1) {
+        value /= 1024;
+        unit++;
+    }
+    return `${value.toFixed(unit === 0 ? 0 : 1)} ${units[unit]}`;
+}
+
+// Render a grid of label/value pairs
+function renderStatusGrid(container, items) {
+    const grid = document.createElement('div');
+    grid.className = 'status-grid';
+    
+    items.forEach(([label, value]) => {
+        const item = document.createElement('div');
+        item.className = 'status-item';
+        
+        const labelDiv = document.createElement('div');
+        labelDiv.className = 'label';
+        labelDiv.textContent = label;
+        
+        const valueDiv = document.createElement('div');
+        valueDiv.className = 'value';
+        valueDiv.textContent = value;
+        
+        item.appendChild(labelDiv);
+        item.appendChild(valueDiv);
+        grid.appendChild(item);
+    });
+    
+    container.innerHTML = '';
+    container.appendChild(grid);
+}
+
+// Load media processing budget usage
+async function loadProcessingStatus() {
+    const container = document.getElementById('processingStatus');
+    
+    try {
+        const response = await fetch('/api/admin/processing', {
+            credentials: 'include'
+        });
+        
+        if (!response.ok) return;
+        
+        const stats = await response.json();
+        renderStatusGrid(container, [
+            ['Decode memory', `${formatBytes(stats.memory_in_use)} / ${formatBytes(stats.memory_budget)}`],
+            ['Active decodes', stats.active_decodes],
+            ['ffmpeg processes', `${stats.active_subprocesses} / ${stats.max_subprocesses}`],
+            ['Waiting', stats.waiting],
+            ['Rejected (busy)', stats.rejected]
+        ]);
+    } catch (error) {
+        console.error('Error loading processing status:', error);
+    }
+}
+
+// Format an estimated duration in seconds for display
+function formatDuration(seconds) {
+    if (seconds === null || seconds === undefined) return 'Estimating...';
+    if (seconds === 0) return 'Caught up';
+    if (seconds < 60) return `${seconds}s`;
+    if (seconds < 3600) return `${Math.round(seconds / 60)} min`;
+    return `${(seconds / 3600).toFixed(1)} h`;
+}
+
+// Load scanner queue depth and catch-up estimates
+async function loadScanStatus() {
+    const container = document.getElementById('scanStatus');
+    
+    try {
+        const response = await fetch('/api/admin/scan-status', {
+            credentials: 'include'
+        });
+        
+        if (!response.ok) return;
+        
+        const status = await response.json();
+        renderStatusGrid(container, [
+            ['Queued directories', status.queue_depth],
+            ['Files remaining (est.)', status.estimated_remaining_files],
+            ['Catch-up time (est.)', formatDuration(status.estimated_catch_up_seconds)]
+        ]);
+        
+        const ul = document.createElement('ul');
+        ul.className = 'users-list scan-users';
+        status.users.forEach(user => {
+            const li = document.createElement('li');
+            li.className = 'user-item';
+            
+            const userInfo = document.createElement('div');
+            userInfo.className = 'user-info';
+            
+            const usernameDiv = document.createElement('div');
+            usernameDiv.className = 'username';
+            usernameDiv.textContent = user.username;
+            
+            const detailsDiv = document.createElement('div');
+            detailsDiv.className = 'created-at';
+            const queued = user.pending_directories + user.changed_directories;
+            detailsDiv.textContent = `${queued} directories queued, ~${user.estimated_remaining_files} files remaining` +
+                (user.files_per_second ? ` at ${user.files_per_second} files/s` : '') +
+                ` - ${formatDuration(user.estimated_catch_up_seconds)}` +
+                ` (${user.added} added, ${user.moved} moved, ${user.removed} removed)`;
+            
+            userInfo.appendChild(usernameDiv);
+            userInfo.appendChild(detailsDiv);
+            li.appendChild(userInfo);
+            
+            if (user.held_removals) {
+                const heldDiv = document.createElement('div');
+                heldDiv.className = 'created-at';
+                heldDiv.textContent = `${user.held_removals} missing files kept until you confirm their removal`;
+                userInfo.appendChild(heldDiv);
+                
+                const confirmBtn = document.createElement('button');
+                confirmBtn.className = 'delete-btn';
+                confirmBtn.textContent = 'Remove missing';
+                confirmBtn.addEventListener('click', () => confirmRemovals(user.username, user.held_removals));
+                li.appendChild(confirmBtn);
+            }
+            ul.appendChild(li);
+        });
+        container.appendChild(ul);
+    } catch (error) {
+        console.error('Error loading scan status:', error);
+    }
+}
+
+async function confirmRemovals(username, count) {
+    if (!confirm(`Remove ${count} media records of "${username}" whose files are gone from disk? Check that their storage is mounted first.`)) {
+        return;
+    }
+    
+    try {
+        const response = await fetch(`/api/admin/scan/${username}/confirm-removals`, {
+            method: 'POST',
+            credentials: 'include'
+        });
+        
+        const data = await response.json();
+        
+        if (response.ok && data.success) {
+            showMessage(data.message, 'success');
+            loadScanStatus();
+        } else {
+            showMessage(data.error || 'Failed to confirm removal', 'error');
+        }
+    } catch (error) {
+        console.error('Error confirming removal:', error);
+        showMessage('Network error. Please try again.', 'error');
+    }
+}
+
 // Show message
 function showMessage(text, type = 'success') {
     const messageDiv = document.getElementById('message');
@@ -166,8 +325,14 @@ async function checkAdmin() {
             return;
         }
         
-        // User is admin, load users
+        // User is admin, load users and server status
         loadUsers();
+        loadProcessingStatus();
+        loadScanStatus();
+        setInterval(() => {
+            loadProcessingStatus();
+            loadScanStatus();
+        }, 5000);
     } catch (error) {
         console.error('Auth check failed:', error);
         window.location.href = '/';
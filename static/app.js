@@ -4,6 +4,13 @@ let currentPage = 1;
 let totalPages = 1;
 let currentMediaList = [];
 let currentViewerIndex = -1;
+let viewerList = []; // Items the viewer steps through; grows past the loaded page via /neighbors
+let viewerHasMore = { previous: false, next: false };
+let viewerExtending = { previous: null, next: null }; // In-flight neighbor requests
+const VIEWER_NEIGHBOR_BATCH = 10;
+const VIEWER_PREFETCH_AHEAD = 2; // Display renditions fetched ahead in the browsing direction
+const PREFETCH_CACHE_SIZE = 8;
+const prefetchCache = new Map(); // Media id -> Image, oldest first
 let currentFilters = {
     year: null,
     month: null,
@@ -14,6 +21,8 @@ let availableFilterOptions = {
     months: [],
     days: []
 };
+let currentSearch = ''; // Filename/folder search; replaces page navigation with "Load more"
+let searchNextCursor = null;
 let currentGalleryOwner = null; // Current user's username (their own gallery by default)
 let accessibleGalleries = [];
 
@@ -236,7 +245,27 @@ function populateFilterDropdowns() {
 }
 
 // Load media from API
+// Query string for the year/month/day filters
+function getFilterQuery() {
+    let query = '';
+    if (currentFilters.year !== null) {
+        query += `&year=${currentFilters.year}`;
+        if (currentFilters.month !== null) {
+            query += `&month=${currentFilters.month}`;
+            if (currentFilters.day !== null) {
+                query += `&day=${currentFilters.day}`;
+            }
+        }
+    }
+    return query;
+}
+
 async function loadMedia(page = 1) {
+    if (currentSearch) {
+        await loadSearchResults();
+        return;
+    }
+    
     const gallery = document.getElementById('gallery');
     const loading = document.getElementById('loading');
     const pagination = document.getElementById('pagination');
@@ -251,16 +280,7 @@ async function loadMedia(page = 1) {
     
     try {
         // Build query string with filters and gallery owner
-        let url = `/api/media?page=${page}&per_page=${perPage}&owner=${currentGalleryOwner}`;
-        if (currentFilters.year !== null) {
-            url += `&year=${currentFilters.year}`;
-            if (currentFilters.month !== null) {
-                url += `&month=${currentFilters.month}`;
-                if (currentFilters.day !== null) {
-                    url += `&day=${currentFilters.day}`;
-                }
-            }
-        }
+        const url = `/api/media?page=${page}&per_page=${perPage}&owner=${currentGalleryOwner}` + getFilterQuery();
         
         const response = await fetch(url, {
             credentials: 'include'
@@ -287,6 +307,69 @@ async function loadMedia(page = 1) {
     }
 }
 
+// Load search results; further pages are fetched by cursor and appended
+async function loadSearchResults(append = false) {
+    const gallery = document.getElementById('gallery');
+    const loading = document.getElementById('loading');
+    const pagination = document.getElementById('pagination');
+    
+    if (!append) {
+        gallery.innerHTML = '';
+        currentMediaList = [];
+        searchNextCursor = null;
+    }
+    loading.classList.remove('hidden');
+    pagination.innerHTML = '';
+    
+    const perPage = parseInt(document.getElementById('perPageSelect').value) || 50;
+    const search = currentSearch;
+    
+    try {
+        let url = `/api/search?q=${encodeURIComponent(search)}&limit=${perPage}` +
+            `&owner=${encodeURIComponent(currentGalleryOwner)}` + getFilterQuery();
+        if (append && searchNextCursor !== null) {
+            url += `&cursor=${searchNextCursor}`;
+        }
+        
+        const response = await fetch(url, {
+            credentials: 'include'
+        });
+        
+        if (response.status === 401) {
+            showLogin();
+            return;
+        }
+        
+        const data = await response.json();
+        // Ignore results for a query the user has already changed
+        if (search !== currentSearch) return;
+        
+        currentMediaList = currentMediaList.concat(data.media || []);
+        searchNextCursor = data.next_cursor;
+        
+        renderGallery(currentMediaList);
+        renderLoadMore();
+        
+    } catch (error) {
+        console.error('Error searching media:', error);
+        gallery.innerHTML = '<p style="text-align: center; padding: 2rem;">Error searching media. Please try again.</p>';
+    } finally {
+        loading.classList.add('hidden');
+    }
+}
+
+function renderLoadMore() {
+    const pagination = document.getElementById('pagination');
+    pagination.innerHTML = '';
+    
+    if (searchNextCursor === null) return;
+    
+    const moreBtn = document.createElement('button');
+    moreBtn.textContent = 'Load more';
+    moreBtn.addEventListener('click', () => loadSearchResults(true));
+    pagination.appendChild(moreBtn);
+}
+
 // Render gallery grid
 function renderGallery(mediaList) {
     const gallery = document.getElementById('gallery');
@@ -294,7 +377,9 @@ function renderGallery(mediaList) {
     
     if (mediaList.length === 0) {
         const hasFilters = currentFilters.year !== null || currentFilters.month !== null || currentFilters.day !== null;
-        const message = hasFilters 
+        const message = currentSearch
+            ? 'No media found matching your search.'
+            : hasFilters 
             ? 'No media found matching the selected filters. Try adjusting your filters or upload some photos or videos to get started!'
             : 'No media found. Upload some photos or videos to get started!';
         gallery.innerHTML = `<p style="text-align: center; padding: 2rem; grid-column: 1 / -1;">${message}</p>`;
@@ -325,7 +410,7 @@ function renderGallery(mediaList) {
         itemDiv.appendChild(mediaElement);
         itemDiv.appendChild(badge);
         
-        itemDiv.addEventListener('click', () => openViewer(index));
+        itemDiv.addEventListener('click', () => startViewer(index));
         
         gallery.appendChild(itemDiv);
     });
@@ -419,10 +504,104 @@ function renderPagination() {
     pagination.appendChild(nextBtn);
 }
 
+// Open the viewer on a gallery item, able to move beyond the loaded page
+function startViewer(index) {
+    viewerList = currentMediaList.slice();
+    // Neighbors follow gallery order, which search results don't
+    viewerHasMore = { previous: !currentSearch, next: !currentSearch };
+    viewerExtending = { previous: null, next: null };
+    openViewer(index);
+}
+
+// Fetch the items beyond one end of viewerList from the server
+function extendViewerList(direction) {
+    if (!viewerHasMore[direction] || viewerList.length === 0) return Promise.resolve();
+    if (viewerExtending[direction]) return viewerExtending[direction];
+    
+    const edge = direction === 'next' ? viewerList[viewerList.length - 1] : viewerList[0];
+    const list = viewerList;
+    viewerExtending[direction] = (async () => {
+        try {
+            const response = await fetch(`/api/media/${edge.id}/neighbors?count=${VIEWER_NEIGHBOR_BATCH}` + getFilterQuery(), {
+                credentials: 'include'
+            });
+            if (!response.ok || list !== viewerList) return;
+            
+            const data = await response.json();
+            const items = data[direction];
+            if (direction === 'next') {
+                viewerList.push(...items);
+            } else {
+                viewerList.unshift(...items);
+                if (currentViewerIndex >= 0) currentViewerIndex += items.length;
+            }
+            if (items.length < VIEWER_NEIGHBOR_BATCH) {
+                viewerHasMore[direction] = false;
+            }
+            updateNavButtons();
+        } catch (error) {
+            console.error('Error loading neighbors:', error);
+        } finally {
+            if (list === viewerList) viewerExtending[direction] = null;
+        }
+    })();
+    return viewerExtending[direction];
+}
+
+// Start downloading an image's display rendition; the Image is kept so the browser keeps it decoded
+function prefetchDisplay(item) {
+    if (!item || item.file_type !== 'image') return;
+    
+    const cached = prefetchCache.get(item.id);
+    prefetchCache.delete(item.id);
+    if (cached) {
+        prefetchCache.set(item.id, cached); // Now most recently used
+        return;
+    }
+    
+    const img = new Image();
+    img.decoding = 'async';
+    img.src = `/api/media/${item.id}/display`;
+    prefetchCache.set(item.id, img);
+    
+    while (prefetchCache.size > PREFETCH_CACHE_SIZE) {
+        const [oldestId, oldest] = prefetchCache.entries().next().value;
+        oldest.removeAttribute('src'); // Cancels the download if still in flight
+        prefetchCache.delete(oldestId);
+    }
+}
+
+// Prefetch around the current item, loading more neighbors before the viewer reaches an end
+function prefetchViewerNeighbors(direction) {
+    const step = direction === 'previous' ? -1 : 1;
+    for (let i = 1; i <= VIEWER_PREFETCH_AHEAD; i++) {
+        prefetchDisplay(viewerList[currentViewerIndex + step * i]);
+    }
+    prefetchDisplay(viewerList[currentViewerIndex - step]);
+    
+    if (currentViewerIndex + VIEWER_PREFETCH_AHEAD >= viewerList.length - 1) {
+        extendViewerList('next').then(() => prefetchDisplay(viewerList[currentViewerIndex + 1]));
+    }
+    if (currentViewerIndex - VIEWER_PREFETCH_AHEAD <= 0) {
+        extendViewerList('previous').then(() => prefetchDisplay(viewerList[currentViewerIndex - 1]));
+    }
+}
+
+// Move the viewer by one item, waiting for neighbors if the loaded list is exhausted
+async function stepViewer(direction) {
+    const step = direction === 'previous' ? -1 : 1;
+    if (!viewerList[currentViewerIndex + step]) {
+        await extendViewerList(direction);
+    }
+    if (currentViewerIndex >= 0 && viewerList[currentViewerIndex + step]) {
+        openViewer(currentViewerIndex + step, direction);
+    }
+}
+
 // Open media viewer
-function openViewer(index) {
+function openViewer(index, direction = 'next') {
     currentViewerIndex = index;
-    const item = currentMediaList[index];
+    const item = viewerList[index];
     
     const viewer = document.getElementById('mediaViewer');
     const viewerImage = document.getElementById('viewerImage');
@@ -444,8 +623,11 @@ function openViewer(index) {
         viewerCreationTime.textContent = '';
     }
     
+    document.getElementById('viewerOriginal').href = `/api/media/${item.id}`;
+    
     if (item.file_type === 'image') {
-        viewerImage.src = `/api/media/${item.id}`;
+        prefetchDisplay(item);
+        viewerImage.src = `/api/media/${item.id}/display`;
         viewerImage.classList.remove('hidden');
         viewerVideo.classList.add('hidden');
         viewerVideo.pause();
@@ -455,9 +637,11 @@ function openViewer(index) {
         viewerVideo.classList.remove('hidden');
         viewerImage.classList.add('hidden');
     }
+    loadVideoPreview(item);
     
     viewer.classList.remove('hidden');
     updateNavButtons();
+    prefetchViewerNeighbors(direction);
     document.body.style.overflow = 'hidden';
 }
 
@@ -471,8 +655,146 @@ function closeViewer() {
     viewerVideo.src = '';
     document.body.style.overflow = '';
     currentViewerIndex = -1;
+    viewerList = [];
+    loadVideoPreview(null);
+}
+
+// Video scrubbing preview (sprite sheet + WebVTT index served by the API)
+let videoPreviewCues = [];
+let videoPreviewMediaId = null;
+
+function parseVttTimestamp(text) {
+    const parts = text.trim().split(':').map(parseFloat);
+    return parts.reduce((total, part) => total * 60 + part, 0);
+}
+
+function parseVideoPreviewVtt(text, baseUrl) {
+    const cues = [];
+    text.split(/\r?\n\r?\n/).forEach(block => {
+        const lines = block.trim().split(/\r?\n/);
+        const timingIndex = lines.findIndex(line => line.includes('-->'));
+        if (timingIndex === -1 || timingIndex + 1 >= lines.length) return;
+        
+        const [start, end] = lines[timingIndex].split('-->');
+        const [url, fragment] = lines[timingIndex + 1].split('#xywh=');
+        if (!fragment) return;
+        
+        const [x, y, w, h] = fragment.split(',').map(Number);
+        cues.push({
+            start: parseVttTimestamp(start),
+            end: parseVttTimestamp(end),
+            url: new URL(url, baseUrl).href,
+            x, y, w, h
+        });
+    });
+    return cues;
+}
+
+async function loadVideoPreview(item) {
+    const scrubber = document.getElementById('videoScrubber');
+    videoPreviewCues = [];
+    videoPreviewMediaId = item && item.file_type === 'video' ? item.id : null;
+    document.getElementById('scrubPreview').classList.add('hidden');
+    document.getElementById('scrubProgress').style.width = '0';
+    
+    if (videoPreviewMediaId === null) {
+        scrubber.classList.add('hidden');
+        return;
+    }
+    scrubber.classList.remove('hidden');
+    
+    const mediaId = videoPreviewMediaId;
+    const indexUrl = new URL(`/api/media/${mediaId}/preview.vtt`, window.location.href).href;
+    try {
+        const response = await fetch(indexUrl, { credentials: 'include' });
+        if (!response.ok) return;
+        const cues = parseVideoPreviewVtt(await response.text(), indexUrl);
+        // Ignore the result if the viewer has moved on to another item
+        if (mediaId === videoPreviewMediaId) {
+            videoPreviewCues = cues;
+        }
+    } catch (error) {
+        console.error('Error loading video preview:', error);
+    }
+}
+
+function getVideoScrubDuration() {
+    const viewerVideo = document.getElementById('viewerVideo');
+    if (isFinite(viewerVideo.duration) && viewerVideo.duration > 0) {
+        return viewerVideo.duration;
+    }
+    return videoPreviewCues.length ? videoPreviewCues[videoPreviewCues.length - 1].end : 0;
 }
 
+function getScrubPosition(e) {
+    const track = document.getElementById('scrubTrack');
+    const rect = track.getBoundingClientRect();
+    const clientX = e.touches ? e.touches[0].clientX : e.clientX;
+    const fraction = Math.min(Math.max((clientX - rect.left) / rect.width, 0), 1);
+    return { fraction, offset: fraction * rect.width };
+}
+
+function showScrubPreview(e) {
+    const duration = getVideoScrubDuration();
+    if (!duration) return;
+    
+    const { fraction, offset } = getScrubPosition(e);
+    const time = fraction * duration;
+    const preview = document.getElementById('scrubPreview');
+    const cue = videoPreviewCues.find(c => time >= c.start && time < c.end) || videoPreviewCues[videoPreviewCues.length - 1];
+    
+    if (cue) {
+        preview.style.width = `${cue.w}px`;
+        preview.style.height = `${cue.h}px`;
+        preview.style.backgroundImage = `url("${cue.url}")`;
+        preview.style.backgroundPosition = `-${cue.x}px -${cue.y}px`;
+    } else {
+        preview.style.width = '80px';
+        preview.style.height = '24px';
+        preview.style.backgroundImage = 'none';
+    }
+    
+    const track = document.getElementById('scrubTrack');
+    const previewWidth = preview.offsetWidth || (cue ? cue.w : 80);
+    const left = Math.min(Math.max(offset - previewWidth / 2, 0), track.offsetWidth - previewWidth);
+    preview.style.left = `${track.offsetLeft + left}px`;
+    
+    const minutes = Math.floor(time / 60);
+    const seconds = Math.floor(time % 60).toString().padStart(2, '0');
+    document.getElementById('scrubPreviewTime').textContent = `${minutes}:${seconds}`;
+    preview.classList.remove('hidden');
+}
+
+function hideScrubPreview() {
+    document.getElementById('scrubPreview').classList.add('hidden');
+}
+
+function seekFromScrub(e) {
+    const duration = getVideoScrubDuration();
+    if (!duration) return;
+    document.getElementById('viewerVideo').currentTime = getScrubPosition(e).fraction * duration;
+}
+
+const scrubTrack = document.getElementById('scrubTrack');
+scrubTrack.addEventListener('mousemove', showScrubPreview);
+scrubTrack.addEventListener('mouseleave', hideScrubPreview);
+scrubTrack.addEventListener('click', seekFromScrub);
+scrubTrack.addEventListener('touchstart', showScrubPreview, { passive: true });
+scrubTrack.addEventListener('touchmove', showScrubPreview, { passive: true });
+scrubTrack.addEventListener('touchend', (e) => {
+    hideScrubPreview();
+    if (e.changedTouches.length) {
+        seekFromScrub({ clientX: e.changedTouches[0].clientX });
+    }
+});
+
+document.getElementById('viewerVideo').addEventListener('timeupdate', () => {
+    const viewerVideo = document.getElementById('viewerVideo');
+    const duration = getVideoScrubDuration();
+    const progress = duration ? Math.min(viewerVideo.currentTime / duration, 1) * 100 : 0;
+    document.getElementById('scrubProgress').style.width = `${progress}%`;
+});
+
 document.getElementById('closeViewer').addEventListener('click', closeViewer);
 
 // Navigation in viewer
@@ -480,21 +802,13 @@ function updateNavButtons() {
     const prevBtn = document.getElementById('prevBtn');
     const nextBtn = document.getElementById('nextBtn');
     
-    prevBtn.disabled = currentViewerIndex <= 0;
-    nextBtn.disabled = currentViewerIndex >= currentMediaList.length - 1;
+    prevBtn.disabled = currentViewerIndex <= 0 && !viewerHasMore.previous;
+    nextBtn.disabled = currentViewerIndex >= viewerList.length - 1 && !viewerHasMore.next;
 }
 
-document.getElementById('prevBtn').addEventListener('click', () => {
-    if (currentViewerIndex > 0) {
-        openViewer(currentViewerIndex - 1);
-    }
-});
+document.getElementById('prevBtn').addEventListener('click', () => stepViewer('previous'));
 
-document.getElementById('nextBtn').addEventListener('click', () => {
-    if (currentViewerIndex < currentMediaList.length - 1) {
-        openViewer(currentViewerIndex + 1);
-    }
-});
+document.getElementById('nextBtn').addEventListener('click', () => stepViewer('next'));
 
 // Keyboard navigation
 document.addEventListener('keydown', (e) => {
@@ -503,10 +817,10 @@ document.addEventListener('keydown', (e) => {
     
     if (e.key === 'Escape') {
         closeViewer();
-    } else if (e.key === 'ArrowLeft' && currentViewerIndex > 0) {
-        openViewer(currentViewerIndex - 1);
-    } else if (e.key === 'ArrowRight' && currentViewerIndex < currentMediaList.length - 1) {
-        openViewer(currentViewerIndex + 1);
+    } else if (e.key === 'ArrowLeft') {
+        stepViewer('previous');
+    } else if (e.key === 'ArrowRight') {
+        stepViewer('next');
     }
 });
 
@@ -568,7 +882,10 @@ fileInput.addEventListener('change', async (e) => {
                 uploadProgress.style.color = '';
             }, 1500);
         } else {
-            uploadProgress.textContent = data.error || 'Upload failed';
+            const uploadedCount = data.uploaded ? data.uploaded.length : 0;
+            uploadProgress.textContent = uploadedCount > 0
+                ? `Uploaded ${uploadedCount} of ${files.length} file(s). ${data.error}`
+                : (data.error || 'Upload failed');
             uploadProgress.style.color = 'var(--error-color)';
             setTimeout(() => {
                 uploadProgress.classList.add('hidden');
@@ -646,6 +963,25 @@ document.getElementById('clearFilters').addEventListener('click', async () => {
     window.scrollTo(0, 0);
 });
 
+// Download the current gallery view (all filters applied) as a streamed ZIP
+document.getElementById('downloadBtn').addEventListener('click', () => {
+    window.location.href = `/api/export?owner=${encodeURIComponent(currentGalleryOwner)}` + getFilterQuery();
+});
+
+// Search as the user types, once they pause
+let searchTimer = null;
+document.getElementById('searchInput').addEventListener('input', (e) => {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => {
+        const search = e.target.value.trim();
+        if (search === currentSearch) return;
+        currentSearch = search;
+        currentPage = 1;
+        loadMedia(1);
+        window.scrollTo(0, 0);
+    }, 300);
+});
+
 // Gallery selector change handler
 document.getElementById('gallerySelect').addEventListener('change', async (e) => {
     const newOwner = e.target.value;
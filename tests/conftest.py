@@ -0,0 +1,60 @@
+import json
+import os
+import sqlite3
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='session')
+def gallery(tmp_path_factory):
+    """Import the app inside a scratch directory holding its config.json and gallery.db"""
+    workdir = tmp_path_factory.mktemp('gallery')
+    config = {
+        'admin': {'username': 'admin', 'password': 'admin'},
+        'server': {'port': 5000},
+        'storage': {
+            'media_path': str(workdir / 'media' / '{username}'),
+            'thumbnail_path': str(workdir / 'thumbnails' / '{username}'),
+        },
+    }
+    (workdir / 'config.json').write_text(json.dumps(config))
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+    import app as gallery_app
+    gallery_app.init_db()
+    yield gallery_app, workdir
+    os.chdir(previous_cwd)
+
+
+@pytest.fixture
+def client(gallery):
+    gallery_app, _ = gallery
+    client = gallery_app.app.test_client()
+    response = client.post('/api/login', json={'username': 'admin', 'password': 'admin'})
+    assert response.status_code == 200
+    return client
+
+
+@pytest.fixture
+def make_user(gallery):
+    """Create a normal user, whose media directory is media/<username> in the scratch directory"""
+    def make_user(username):
+        conn = sqlite3.connect('gallery.db')
+        conn.execute('INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?)', (username, 'x'))
+        conn.commit()
+        conn.close()
+    return make_user
+
+
+@pytest.fixture
+def scan(gallery):
+    """Run scanner cycles until every user's queue is drained"""
+    gallery_app, _ = gallery
+    def scan():
+        while gallery_app.scan_scheduler.run_cycle(1.0):
+            pass
+    return scan
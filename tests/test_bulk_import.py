@@ -0,0 +1,49 @@
+import multiprocessing
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+MB = 1024 * 1024
+
+
+def timed_decode(amount):
+    import app
+    with app.processing_governor.decode(amount):
+        started = time.monotonic()
+        time.sleep(0.3)
+        return started, time.monotonic()
+
+
+def run_decodes(gallery_app, budget, amount):
+    mp_context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=2, mp_context=mp_context, initializer=gallery_app.init_import_worker,
+                             initargs=(budget, mp_context.Condition(), mp_context.Value('q', 0, lock=False))) as executor:
+        (start_a, end_a), (start_b, end_b) = executor.map(timed_decode, [amount, amount])
+    return start_a < end_b and start_b < end_a
+
+
+def test_import_workers_share_one_decode_budget(gallery):
+    gallery_app, _ = gallery
+    assert run_decodes(gallery_app, 100 * MB, 40 * MB)
+    assert not run_decodes(gallery_app, 100 * MB, 60 * MB)
+
+
+def test_symlinked_media_directory_is_indexed_once(gallery, make_user, scan, tmp_path):
+    gallery_app, workdir = gallery
+    make_user('linked')
+    real = tmp_path / 'real'
+    (real / 'trip').mkdir(parents=True)
+    (workdir / 'media').mkdir(exist_ok=True)
+    (workdir / 'media' / 'linked').symlink_to(real)
+    for i in range(3):
+        Image.new('RGB', (64, 48), (i * 60, 20, 20)).save(real / 'trip' / f'{i}.jpg')
+    
+    assert gallery_app.bulk_import('linked', str(real / 'trip'), workers=2) == 0
+    scan()
+    
+    conn = sqlite3.connect('gallery.db')
+    rows = conn.execute("SELECT filepath, folder FROM media WHERE owner_username = 'linked' ORDER BY filepath").fetchall()
+    conn.close()
+    assert rows == [(str(workdir / 'media' / 'linked' / 'trip' / f'{i}.jpg'), 'trip') for i in range(3)]
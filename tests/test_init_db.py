@@ -0,0 +1,27 @@
+import sqlite3
+
+
+def test_init_db_is_repeatable_and_enables_wal(gallery):
+    gallery_app, _ = gallery
+    gallery_app.init_db()
+    gallery_app.init_db()
+    conn = sqlite3.connect('gallery.db')
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert conn.execute('PRAGMA user_version').fetchone()[0] >= 1
+    conn.close()
+
+
+def test_shared_thumbnail_hash_cleanup_runs_once(gallery):
+    gallery_app, workdir = gallery
+    conn = sqlite3.connect('gallery.db')
+    rows = [('IMG_0001.jpg', str(workdir / folder / 'IMG_0001.jpg'), 'image', 0,
+             str(workdir / 'thumbnails' / 'IMG_0001_thumb.jpg'), 'admin', 1234) for folder in ('copy1', 'copy2')]
+    conn.executemany('''INSERT INTO media (filename, filepath, file_type, size, thumbnail_path, owner_username, perceptual_hash)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+    conn.commit()
+    gallery_app.init_db()
+    hashes = conn.execute('SELECT perceptual_hash FROM media WHERE filename = ?', ('IMG_0001.jpg',)).fetchall()
+    assert hashes == [(1234,), (1234,)]
+    conn.execute('DELETE FROM media WHERE filename = ?', ('IMG_0001.jpg',))
+    conn.commit()
+    conn.close()
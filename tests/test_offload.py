@@ -0,0 +1,110 @@
+import os
+import sqlite3
+from urllib.parse import unquote
+
+import pytest
+
+INTERNAL_URI = '/_protected/media'
+
+
+@pytest.fixture
+def media_root(gallery, tmp_path, monkeypatch):
+    """An x-accel-redirect location covering tmp_path/media"""
+    gallery_app, _ = gallery
+    root = tmp_path / 'media'
+    root.mkdir()
+    monkeypatch.setitem(gallery_app.app.config, 'OFFLOAD_MODE', 'x-accel-redirect')
+    monkeypatch.setitem(gallery_app.app.config, 'OFFLOAD_LOCATIONS', [(str(root), INTERNAL_URI)])
+    return root
+
+
+def add_media(filepath):
+    conn = sqlite3.connect('gallery.db')
+    c = conn.cursor()
+    c.execute('INSERT INTO media (filename, filepath, file_type, size, owner_username) VALUES (?, ?, ?, ?, ?)',
+              (os.path.basename(filepath), str(filepath), 'image', 0, 'admin'))
+    media_id = c.lastrowid
+    conn.commit()
+    conn.close()
+    return media_id
+
+
+def proxy(app_module, response):
+    """Stand-in for nginx: resolve X-Accel-Redirect against the configured internal locations"""
+    internal_uri = response.headers.get('X-Accel-Redirect')
+    if internal_uri is None:
+        return response.get_data()
+    assert response.get_data() == b''
+    for location_path, location_uri in app_module.app.config['OFFLOAD_LOCATIONS']:
+        if internal_uri.startswith(location_uri + '/'):
+            relative = unquote(internal_uri[len(location_uri) + 1:])
+            # nginx rejects URIs that climb out of the location
+            assert '..' not in relative.split('/')
+            with open(os.path.join(location_path, relative), 'rb') as f:
+                return f.read()
+    raise AssertionError(f'No internal location serves {internal_uri}')
+
+
+def fetch(gallery, client, filepath):
+    response = client.get(f'/api/media/{add_media(filepath)}')
+    assert response.status_code == 200
+    return response, proxy(gallery[0], response)
+
+
+def test_file_inside_location_is_offloaded(gallery, client, media_root):
+    path = media_root / 'album' / 'photo.jpg'
+    path.parent.mkdir()
+    path.write_bytes(b'inside')
+    response, body = fetch(gallery, client, path)
+    assert response.headers['X-Accel-Redirect'] == f'{INTERNAL_URI}/album/photo.jpg'
+    assert body == b'inside'
+
+
+def test_file_outside_locations_falls_back_to_send_file(gallery, client, media_root, tmp_path):
+    path = tmp_path / 'elsewhere' / 'photo.jpg'
+    path.parent.mkdir()
+    path.write_bytes(b'outside')
+    response, body = fetch(gallery, client, path)
+    assert 'X-Accel-Redirect' not in response.headers
+    assert body == b'outside'
+
+
+def test_sibling_with_shared_prefix_is_not_offloaded(gallery, client, media_root, tmp_path):
+    path = tmp_path / 'media-private' / 'photo.jpg'
+    path.parent.mkdir()
+    path.write_bytes(b'sibling')
+    response, body = fetch(gallery, client, path)
+    assert 'X-Accel-Redirect' not in response.headers
+    assert body == b'sibling'
+
+
+def test_dotdot_path_escaping_location_is_not_offloaded(gallery, client, media_root, tmp_path):
+    outside = tmp_path / 'secret.jpg'
+    outside.write_bytes(b'secret')
+    response, body = fetch(gallery, client, f'{media_root}/../secret.jpg')
+    assert 'X-Accel-Redirect' not in response.headers
+    assert body == b'secret'
+
+
+def test_symlink_escaping_location_is_not_offloaded(gallery, client, media_root, tmp_path):
+    outside = tmp_path / 'linked.jpg'
+    outside.write_bytes(b'linked')
+    link = media_root / 'link.jpg'
+    link.symlink_to(outside)
+    response, body = fetch(gallery, client, link)
+    assert 'X-Accel-Redirect' not in response.headers
+    assert body == b'linked'
+
+
+@pytest.mark.parametrize('name, quoted', [
+    ('my photo.jpg', 'my%20photo.jpg'),
+    ('100% #1?.jpg', '100%25%20%231%3F.jpg'),
+    ('été.jpg', '%C3%A9t%C3%A9.jpg'),
+])
+def test_special_characters_are_escaped(gallery, client, media_root, name, quoted):
+    path = media_root / 'my album' / name
+    path.parent.mkdir()
+    path.write_bytes(name.encode())
+    response, body = fetch(gallery, client, path)
+    assert response.headers['X-Accel-Redirect'] == f'{INTERNAL_URI}/my%20album/{quoted}'
+    assert body == name.encode()
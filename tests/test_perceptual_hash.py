@@ -0,0 +1,44 @@
+import sqlite3
+
+from PIL import Image, ImageDraw
+
+
+def test_transparent_image_hashes_match_thumbnail_hash(gallery, tmp_path):
+    gallery_app, _ = gallery
+    img = Image.new('RGBA', (300, 200), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((20, 20, 180, 160), fill=(200, 30, 30, 255))
+    draw.rectangle((150, 40, 280, 190), fill=(30, 30, 200, 128))
+    path = tmp_path / 'logo.png'
+    img.save(path)
+    thumbnail_hash = gallery_app.generate_thumbnail(str(path), 'image', str(tmp_path / 'logo_thumb.jpg'))
+    assert thumbnail_hash is not None
+    assert gallery_app.hash_image_file(str(path)) == thumbnail_hash
+
+
+def test_unhashable_images_are_backfilled_once(gallery, make_user, scan, monkeypatch):
+    gallery_app, workdir = gallery
+    make_user('hashes')
+    media_dir = workdir / 'media' / 'hashes'
+    media_dir.mkdir(parents=True)
+    Image.new('RGB', (200, 200), (90, 90, 90)).save(media_dir / 'flat.png')
+    (media_dir / 'corrupt.jpg').write_bytes(b'not an image')
+    monkeypatch.setitem(gallery_app.app.config, 'SCAN_INTERVAL', 0)
+    scan()
+    
+    conn = sqlite3.connect('gallery.db')
+    conn.execute("UPDATE media SET phash_pending = 1 WHERE owner_username = 'hashes'")
+    conn.commit()
+    
+    calls = []
+    hash_image_file = gallery_app.hash_image_file
+    monkeypatch.setattr(gallery_app, 'hash_image_file', lambda path: calls.append(path) or hash_image_file(path))
+    scan()
+    assert len(calls) == 2
+    assert conn.execute("SELECT perceptual_hash, phash_pending FROM media WHERE owner_username = 'hashes'").fetchall() == [
+        (None, 0), (None, 0)]
+    
+    calls.clear()
+    scan()
+    assert calls == []
+    conn.close()
@@ -0,0 +1,106 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+from PIL import Image
+
+
+@pytest.fixture
+def gallery_dir(gallery, make_user, monkeypatch):
+    """A user with a media directory of photos; every scan() makes a full pass"""
+    gallery_app, workdir = gallery
+    monkeypatch.setitem(gallery_app.app.config, 'SCAN_INTERVAL', 0)
+    
+    def gallery_dir(username, folders):
+        make_user(username)
+        media_dir = workdir / 'media' / username
+        for folder, count in folders.items():
+            (media_dir / folder).mkdir(parents=True)
+            for i in range(count):
+                Image.new('RGB', (64, 48), (i * 30, len(folder) * 20, 90)).save(media_dir / folder / f'{folder}_{i}.jpg')
+        return media_dir
+    return gallery_dir
+
+
+def media_rows(username):
+    conn = sqlite3.connect('gallery.db')
+    rows = conn.execute('SELECT id, filepath, thumbnail_path FROM media WHERE owner_username = ? ORDER BY id',
+                        (username,)).fetchall()
+    conn.close()
+    return rows
+
+
+def test_renamed_folder_keeps_rows_and_thumbnails(gallery, gallery_dir, scan):
+    media_dir = gallery_dir('mover', {'trip': 3, 'home': 1})
+    scan()
+    before = media_rows('mover')
+    assert len(before) == 4
+    
+    os.rename(media_dir / 'trip', media_dir / 'trip 2023')
+    scan()
+    after = media_rows('mover')
+    assert [row[0] for row in after] == [row[0] for row in before]
+    assert [row[2] for row in after] == [row[2] for row in before]
+    assert sorted(row[1] for row in after if 'trip 2023' in row[1]) == [
+        str(media_dir / 'trip 2023' / f'trip_{i}.jpg') for i in range(3)]
+    assert all(os.path.exists(row[2]) for row in after)
+
+
+def test_missing_empty_or_remounted_media_directory_deletes_nothing(gallery, gallery_dir, scan):
+    gallery_app, _ = gallery
+    media_dir = gallery_dir('unmounted', {'a': 2, 'b': 2})
+    scan()
+    assert len(media_rows('unmounted')) == 4
+    
+    offline = media_dir.with_name('unmounted-offline')
+    os.rename(media_dir, offline)
+    scan()
+    assert len(media_rows('unmounted')) == 4
+    
+    media_dir.mkdir()
+    scan()
+    assert len(media_rows('unmounted')) == 4
+    
+    media_dir.rmdir()
+    os.rename(offline, media_dir)
+    state = gallery_app.scan_scheduler.users['unmounted']
+    state.root_device += 1  # As if another filesystem were mounted there
+    shutil.rmtree(media_dir / 'a')
+    scan()
+    assert len(media_rows('unmounted')) == 4
+
+
+def test_large_removal_waits_for_confirmation(gallery, gallery_dir, scan, monkeypatch):
+    gallery_app, _ = gallery
+    monkeypatch.setitem(gallery_app.app.config, 'RECONCILE_MIN_ROWS', 1)
+    media_dir = gallery_dir('pruner', {'old': 3, 'keep': 1})
+    scan()
+    assert not gallery_app.scan_scheduler.confirm_removals('pruner')
+    
+    shutil.rmtree(media_dir / 'old')
+    scan()
+    state = gallery_app.scan_scheduler.users['pruner']
+    assert len(media_rows('pruner')) == 4
+    assert state.held_removals == 3
+    
+    assert gallery_app.scan_scheduler.confirm_removals('pruner')
+    scan()
+    rows = media_rows('pruner')
+    assert [row[1] for row in rows] == [str(media_dir / 'keep' / 'keep_0.jpg')]
+    assert state.held_removals == 0
+
+
+def test_conflicting_write_is_skipped_and_the_rest_committed(gallery, gallery_dir, scan):
+    gallery_app, _ = gallery
+    gallery_dir('racer', {'x': 2})
+    scan()
+    (first_id, first_path, _), (_, second_path, _) = media_rows('racer')
+    
+    gallery_app.scan_scheduler._commit('racer', [
+        ('MOVE', first_id, os.path.basename(second_path), second_path, 'x', 1, None),
+        ('INODE', 4242, first_path),
+    ])
+    conn = sqlite3.connect('gallery.db')
+    assert conn.execute('SELECT filepath, inode FROM media WHERE id = ?', (first_id,)).fetchone() == (first_path, 4242)
+    conn.close()
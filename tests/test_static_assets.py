@@ -0,0 +1,59 @@
+import os
+import shutil
+import time
+
+import pytest
+
+DAY = 86400
+
+
+@pytest.fixture
+def static_build(gallery, tmp_path, monkeypatch):
+    """Build assets from a scratch copy of static/, so a test can change them between deploys"""
+    gallery_app, _ = gallery
+    static_dir = tmp_path / 'static'
+    shutil.copytree(gallery_app.app.static_folder, static_dir)
+    monkeypatch.setattr(gallery_app.app, 'static_folder', str(static_dir))
+    monkeypatch.setitem(gallery_app.app.config, 'STATIC_BUILD_DIR', str(tmp_path / 'static_build'))
+    monkeypatch.setattr(gallery_app, 'static_manifest', None)
+    
+    def deploy(script):
+        (static_dir / 'app.js').write_text(script)
+        gallery_app.static_manifest = None
+        manifest = gallery_app.get_static_manifest()
+        return next(name for name in manifest['assets'] if name.startswith('app.'))
+    return deploy
+
+
+def age(build_dir, name, seconds):
+    for path in build_dir.glob(name + '*'):
+        old = time.time() - seconds
+        os.utime(path, (old, old))
+
+
+def test_previous_build_is_served_for_a_day_after_it_is_replaced(gallery, static_build, tmp_path):
+    gallery_app, _ = gallery
+    client = gallery_app.app.test_client()
+    build_dir = tmp_path / 'static_build'
+    
+    first = static_build('console.log(1);')
+    age(build_dir, first, 30 * DAY)  # Built long before the next deploy
+    second = static_build('console.log(2);')
+    assert first != second
+    for name in (first, second):
+        response = client.get(f'/assets/{name}')
+        assert response.status_code == 200
+        assert 'immutable' in response.headers['Cache-Control']
+    
+    age(build_dir, first, 2 * DAY)  # Retired longer ago than the retention
+    static_build('console.log(3);')
+    assert client.get(f'/assets/{first}').status_code == 404
+    assert client.get(f'/assets/{second}').status_code == 200
+
+
+def test_only_built_assets_are_served(gallery, static_build):
+    gallery_app, _ = gallery
+    client = gallery_app.app.test_client()
+    static_build('console.log(1);')
+    assert client.get('/assets/manifest.json').status_code == 404
+    assert client.get('/assets/..%2Fconfig.json').status_code == 404